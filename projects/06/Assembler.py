@@ -1,17 +1,270 @@
+import itertools
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+
 class ArgumentError(BaseException):
     pass
 
 
+def strip_line(line):
+    line = line.strip()
+
+    # Ignore inline comments
+    if '//' in line:
+        comment_index = line.index('//')
+        line = line[:comment_index]
+        line = line.strip()
+
+    return line
+
+
+def split_c_instruction(command):
+    """
+    Split a `dest=comp;jump` C-instruction into its three (possibly empty) fields
+    """
+    dest, comp, jump = '', command, ''
+    if '=' in comp:
+        dest, comp = comp.split('=', 1)
+    if ';' in comp:
+        comp, jump = comp.split(';', 1)
+
+    return dest, comp, jump
+
+
 class Parser:
-    def __init__(self, file):
+    def __init__(self, file=None, binary=False, symbols=False, cache=None, stats=None,
+                 optimize=False):
         self.A_COMMAND = 'A_COMMAND'
         self.C_COMMAND = 'C_COMMAND'
         self.L_COMMAND = 'L_COMMAND'
 
-        filename, extension = file.split('.')
-        if extension != 'asm':
+        self._stats = stats
+        self.removed_instructions = 0
+
+        # Without a file the parser is only used through `assemble`
+        if file is None:
+            return
+
+        filename, extension = os.path.splitext(file)
+        if extension != '.asm':
             raise ArgumentError('File should have .asm extension')
 
+        with open(file, 'r') as asm_file:
+            if cache is None:
+                self.words, self.symbol_table = self.assemble(
+                    asm_file, stats=stats, optimize=optimize)
+            else:
+                self.words, self.symbol_table = self._assemble_cached(
+                    asm_file.read(), cache, optimize)
+
+        if binary:
+            self._instrument('write', write_hackbin)(
+                self.words, filename + '.hackbin',
+                self.symbol_table if symbols else None)
+        else:
+            self._instrument('write', write_hack)(self.words, filename + '.hack')
+
+    def assemble(self, lines, stats=None, optimize=False):
+        """
+        Assemble an iterable of source lines, returning the instruction words
+        as an array('H') together with the final symbol table.
+        Pass a Stats object to record where the time goes, and `optimize` to
+        run the peephole optimizer first (the number of instructions it
+        removed is left in `self.removed_instructions`).
+        """
+        if stats is not None:
+            self._stats = stats
+
+        start = time.perf_counter()
+
+        if optimize:
+            lines, self.removed_instructions = peephole(lines)
+            self._add_time('optimize', start)
+
+        symbol_table = self._predefined_symbol_table()
+
+        if self._stats is not None:
+            # Instance attributes shadow the methods, so only this table pays
+            # for the timing
+            symbol_table.add_entry = self._stats.wrap('symbols', symbol_table.add_entry)
+            symbol_table.contains = self._stats.wrap('symbols', symbol_table.contains)
+            symbol_table.get_address = self._stats.wrap('symbols', symbol_table.get_address)
+
+        words = self._assemble_two_pass(lines, symbol_table)
+
+        if self._stats is not None:
+            self._stats.add_time('total', start)
+            self._stats.count_program(words, symbol_table, self.variable_count)
+
+            del symbol_table.add_entry, symbol_table.contains, symbol_table.get_address
+
+        return words, symbol_table
+
+    def _assemble_cached(self, source, cache, optimize):
+        key = cache.key(source, 'optimize' if optimize else '')
+        entry = cache.get(key)
+
+        if entry is not None:
+            symbol_table = SymbolTable()
+            for symbol, address in entry['symbols'].items():
+                symbol_table.add_entry(symbol, address)
+
+            self.removed_instructions = entry['removed']
+            return array('H', entry['words']), symbol_table
+
+        words, symbol_table = self.assemble(source.splitlines(), optimize=optimize)
+        cache.put(key, {'words': words.tolist(), 'symbols': symbol_table.table,
+                        'removed': self.removed_instructions})
+
+        return words, symbol_table
+
+    def _assemble_two_pass(self, lines, symbol_table):
+        # First Phase: searching for label symbols and adding them to the symbol table.
+        # The stripped commands are kept so the second phase doesn't redo it.
+        strip = self._instrument('strip', strip_line)
+        encode = self._instrument('encode', Code.encode)
+        start = time.perf_counter()
+
+        commands = []
+        rom_counter = 0
+
+        for line in lines:
+            line = strip(line)
+
+            # Ignore comments and empty lines
+            if line == '':
+                continue
+
+            self.command = line
+
+            if self.command_type() == self.L_COMMAND:
+                symbol_table.add_entry(self.symbol(), self._label_address(rom_counter))
+                continue  # Don't increment the ROM counter when encounter a label
+
+            commands.append(line)
+            rom_counter += 1
+
+        self._add_time('labels', start)
+
+        # Second Phase: adding variable symbols to the symbol table and actual translation
+        start = time.perf_counter()
+        words = array('H')
+        symbol_ram_address_counter = 16
+
+        for command in commands:
+            self.command = command
+
+            if self.command_type() == self.A_COMMAND:
+                symbol = self.symbol()
+
+                if symbol is None:
+                    ram_address = self._constant()
+                elif symbol_table.contains(symbol):
+                    ram_address = symbol_table.get_address(symbol)
+                else:
+                    ram_address = symbol_ram_address_counter
+                    symbol_table.add_entry(symbol, ram_address)
+                    symbol_ram_address_counter += 1
+
+                words.append(ram_address)
+            else:
+                words.append(encode(command))
+
+        self._add_time('translation', start)
+        self.variable_count = symbol_ram_address_counter - 16
+
+        return words
+
+    def stream(self, lines, chunk_size=4096, backpatch=False):
+        """
+        Assemble an iterable of source lines incrementally, yielding chunks of
+        instruction words (array('H')) as soon as they are fully resolved.
+        The final symbol table is left in `self.symbol_table`.
+
+        A symbol that isn't defined yet is only known to be a variable at the
+        end, so by default every word from its first reference onwards is held
+        back until it resolves. Memory then grows with the program rather than
+        with the symbol table: VM translator output references `@endFrame`,
+        `@retAddr` or static variables early, and most of it waits for the
+        end. With `backpatch`, for outputs that can seek back, these words are
+        yielded as 0 right away and `self.patches` gets the (address, value)
+        pairs to overwrite them with, so only one chunk and one pair per
+        forward reference are kept.
+        """
+        self.symbol_table = symbol_table = self._predefined_symbol_table()
+        self.patches = patches = []
+        pending = array('H')  # words not emitted yet, starting at address `pending_start`
+        pending_start = 0
+        fixups = dict()  # symbol -> addresses of the words waiting for it
+
+        def resolve(address, value):
+            if address >= pending_start:
+                pending[address - pending_start] = value
+            else:
+                patches.append((address, value))
+
+        for line in lines:
+            line = strip_line(line)
+
+            # Ignore comments and empty lines
+            if line == '':
+                continue
+
+            self.command = line
+            command_type = self.command_type()
+            rom_counter = pending_start + len(pending)
+
+            if command_type == self.L_COMMAND:
+                symbol = self.symbol()
+                symbol_table.add_entry(symbol, self._label_address(rom_counter))
+
+                for address in fixups.pop(symbol, ()):
+                    resolve(address, rom_counter)
+            elif command_type == self.A_COMMAND:
+                symbol = self.symbol()
+
+                if symbol is None:
+                    pending.append(self._constant())
+                elif symbol_table.contains(symbol):
+                    pending.append(symbol_table.get_address(symbol))
+                else:
+                    fixups.setdefault(symbol, []).append(rom_counter)
+                    pending.append(0)
+            else:
+                pending.append(Code.encode(line))
+
+            # Symbols are inserted in order of first reference, so the first
+            # entry of `fixups` always holds the earliest unresolved word
+            if len(pending) >= chunk_size:
+                if fixups and not backpatch:
+                    resolved = next(iter(fixups.values()))[0] - pending_start
+                else:
+                    resolved = len(pending)
+
+                if resolved >= chunk_size:
+                    yield pending[:resolved]
+                    del pending[:resolved]
+                    pending_start += resolved
+
+        # Whatever is still unresolved at the end is a variable
+        symbol_ram_address_counter = 16
+
+        for symbol, addresses in fixups.items():
+            symbol_table.add_entry(symbol, symbol_ram_address_counter)
+            for address in addresses:
+                resolve(address, symbol_ram_address_counter)
+            symbol_ram_address_counter += 1
+
+        if pending:
+            yield pending
+
+    def _predefined_symbol_table(self):
         # Initialization: add all predefined symbols
         symbol_table = SymbolTable()
         symbol_table.add_entry('SP', 0)
@@ -38,81 +291,37 @@ class Parser:
         symbol_table.add_entry('SCREEN', 16384)
         symbol_table.add_entry('KBD', 24576)
 
-        # First Phase: searching for label symbols and adding them to the symbol table
-        with open(file, 'r') as asm_file:
-            rom_counter = 0
+        return symbol_table
 
-            for line in asm_file:
-                line = line.strip()
+    def _instrument(self, phase, function):
+        # Hot loops bind their helpers once through this, so running without
+        # stats costs nothing per line
+        if self._stats is None:
+            return function
 
-                # Ignore comments and empty lines
-                if line.startswith('//') or line == '':
-                    continue
+        return self._stats.wrap(phase, function)
 
-                # Ignore inline comments
-                if '//' in line:
-                    comment_index = line.index('//')
-                    line = line[:comment_index]
-                    line = line.strip()
+    def _add_time(self, phase, start):
+        if self._stats is not None:
+            self._stats.add_time(phase, start)
 
-                self.command = line
+    def _label_address(self, rom_counter):
+        # Labels are loaded with A-instructions, so they must fit in 15 bits
+        if rom_counter > 0x7fff:
+            raise ValueError(
+                '"{}" is beyond the 32K instruction ROM.'.format(self.command))
 
-                if self.command_type() == self.L_COMMAND:
-                    symbol_table.add_entry(self.symbol(), rom_counter)
-                    continue  # Don't increment the ROM counter when encounter a label
+        return rom_counter
 
-                rom_counter += 1
+    def _constant(self):
+        value = int(self.command[1:])
 
-        # Second Phase: adding variable symbols to the symbol table and actual translation
-        with open(filename + '.hack', 'w') as hack_file:
-            with open(file, 'r') as asm_file:
-                symbol_ram_address_counter = 16
-
-                for line in asm_file:
-                    line = line.strip()
-
-                    # Ignore comments and empty lines
-                    if line.startswith('//') or line == '':
-                        continue
-
-                    # Ignore inline comments
-                    if '//' in line:
-                        comment_index = line.index('//')
-                        line = line[:comment_index]
-                        line = line.strip()
-
-                    self.command = line
-
-                    if self.command_type() == self.A_COMMAND:
-                        ram_address = 0
-
-                        if self.symbol():
-                            symbol = self.symbol()
-                            if symbol_table.contains(symbol):
-                                ram_address = symbol_table.get_address(symbol)
-                            else:
-                                ram_address = symbol_ram_address_counter
-                                symbol_table.add_entry(symbol, ram_address)
-                                symbol_ram_address_counter += 1
-                        else:
-                            ram_address = int(self.command[1:])
-
-                        hack_file.write(
-                            '0' + '{0:015b}'.format(ram_address) + '\n')
-                    if self.command_type() == self.C_COMMAND:
-                        c = self.comp()
-                        d = self.dest()
-                        j = self.jump()
-
-                        cc = Code.comp(c)
-                        dd = Code.dest(d)
-                        jj = Code.jump(j)
-
-                        # C instructions always start with 111 bits
-                        hack_file.write('111' + cc + dd + jj + '\n')
-
-        # for key, value in symbol_table.table.items():
-        #     print('symbol: ' + key + ', address: ' + str(value))
+        # The most significant bit tells A- and C-instructions apart
+        if value > 0x7fff:
+            raise ValueError(
+                '"{}" is out of the 15-bit A-instruction range.'.format(self.command))
+
+        return value
 
     def command_type(self):
         if self.command[0] == '@':
@@ -160,131 +369,232 @@ class Parser:
             return self.command[semi_colon_index+1:]
 
 
+# comp field of a C-instruction: the `a` bit followed by c1..c6
+COMP_TABLE = {
+    '0': 0b0101010,
+    '1': 0b0111111,
+    '-1': 0b0111010,
+    'D': 0b0001100,
+    'A': 0b0110000,
+    '!D': 0b0001101,
+    '!A': 0b0110001,
+    '-D': 0b0001111,
+    '-A': 0b0110011,
+    'D+1': 0b0011111,
+    'A+1': 0b0110111,
+    'D-1': 0b0001110,
+    'A-1': 0b0110010,
+    'D+A': 0b0000010,
+    'D-A': 0b0010011,
+    'A-D': 0b0000111,
+    'D&A': 0b0000000,
+    'D|A': 0b0010101,
+}
+
+# Every A-based computation also exists with a=1, reading M instead of A
+COMP_TABLE.update({mnemonic.replace('A', 'M'): bits | 0b1000000
+                   for mnemonic, bits in list(COMP_TABLE.items()) if 'A' in mnemonic})
+
+# Commuted forms of the commutative operations, e.g. `1+D`, `M+D`, `A&D`
+COMP_TABLE.update({mnemonic[::-1]: bits
+                   for mnemonic, bits in list(COMP_TABLE.items())
+                   if len(mnemonic) == 3 and mnemonic[1] in '+&|'})
+
+# dest field: the destination registers may be listed in any order
+DEST_TABLE = {'': 0b000}
+for _registers in itertools.chain.from_iterable(
+        itertools.permutations('ADM', n) for n in range(1, 4)):
+    DEST_TABLE[''.join(_registers)] = (('A' in _registers) << 2 |
+                                       ('D' in _registers) << 1 |
+                                       ('M' in _registers))
+
+# jump field, '' corresponds to null
+JUMP_TABLE = {
+    '': 0b000,
+    'JGT': 0b001,
+    'JEQ': 0b010,
+    'JGE': 0b011,
+    'JLT': 0b100,
+    'JNE': 0b101,
+    'JLE': 0b110,
+    'JMP': 0b111,
+}
+
+# Whole C-instruction string -> encoded 16-bit word
+_c_instruction_cache = dict()
+
+
 class Code:
 
     @staticmethod
     def dest(mnemonic):
-        binary_str = ''
-
-        if 'A' in mnemonic:
-            binary_str += '1'
-        else:
-            binary_str += '0'
-
-        if 'D' in mnemonic:
-            binary_str += '1'
-        else:
-            binary_str += '0'
-
-        if 'M' in mnemonic:
-            binary_str += '1'
-        else:
-            binary_str += '0'
-
-        return binary_str
+        return '{0:03b}'.format(Code._lookup(DEST_TABLE, mnemonic, 'dest'))
 
     @staticmethod
     def comp(mnemonic):
-        binary_str = ''
-
-        if mnemonic == '0':
-            binary_str = '0101010'
-
-        if mnemonic == '1':
-            binary_str = '0111111'
-
-        if mnemonic == '-1':
-            binary_str = '0111010'
-
-        if mnemonic == 'D':
-            binary_str = '0001100'
-
-        if mnemonic == 'A':
-            binary_str = '0110000'
-
-        if mnemonic == 'M':
-            binary_str = '1110000'
-
-        if mnemonic == '!D':
-            binary_str = '0001101'
-
-        if mnemonic[0] == '!':
-            if mnemonic[1] == 'A':
-                binary_str = '0110001'
-            if mnemonic[1] == 'M':
-                binary_str = '1110001'
-
-        if mnemonic == '-D':
-            binary_str = '0001111'
-
-        if mnemonic[0] == '-':
-            if mnemonic[1] == 'A':
-                binary_str = '0110011'
-            if mnemonic[1] == 'M':
-                binary_str = '1110011'
-
-        if mnemonic == 'D+1':
-            binary_str = '0011111'
-
-        if mnemonic[1:3] == '+1':
-            if mnemonic[0] == 'A':
-                binary_str = '0110111'
-            if mnemonic[0] == 'M':
-                binary_str = '1110111'
-
-        if mnemonic == 'D-1':
-            binary_str = '0001110'
-
-        if mnemonic[1:3] == '-1':
-            if mnemonic[0] == 'A':
-                binary_str = '0110010'
-            if mnemonic[0] == 'M':
-                binary_str = '1110010'
-
-        if mnemonic[0:2] == 'D+':
-            if mnemonic[2] == 'A':
-                binary_str = '0000010'
-            if mnemonic[2] == 'M':
-                binary_str = '1000010'
-
-        if mnemonic[0:2] == 'D-':
-            if mnemonic[2] == 'A':
-                binary_str = '0010011'
-            if mnemonic[2] == 'M':
-                binary_str = '1010011'
-
-        if mnemonic[1:3] == '-D':
-            if mnemonic[0] == 'A':
-                binary_str = '0000111'
-            if mnemonic[0] == 'M':
-                binary_str = '1000111'
-
-        if mnemonic[0:2] == 'D&':
-            if mnemonic[2] == 'A':
-                binary_str = '0000000'
-            if mnemonic[2] == 'M':
-                binary_str = '1000000'
-
-        if mnemonic[0:2] == 'D|':
-            if mnemonic[2] == 'A':
-                binary_str = '0010101'
-            if mnemonic[2] == 'M':
-                binary_str = '1010101'
-
-        return binary_str
+        return '{0:07b}'.format(Code._lookup(COMP_TABLE, mnemonic, 'comp'))
 
     @staticmethod
     def jump(mnemonic):
-        jump_dict = {'JGT': '001',
-                     'JEQ': '010',
-                     'JGE': '011',
-                     'JLT': '100',
-                     'JNE': '101',
-                     'JLE': '110',
-                     'JMP': '111'}
+        return '{0:03b}'.format(Code._lookup(JUMP_TABLE, mnemonic, 'jump'))
 
-        # 000 corresponds to null
-        return jump_dict.get(mnemonic, '000')
+    @staticmethod
+    def encode(command):
+        """
+        Encode a whole `dest=comp;jump` C-instruction into its 16-bit word.
+        Results are cached by the instruction string since real programs only
+        use a few dozen distinct C-instructions.
+        """
+        try:
+            return _c_instruction_cache[command]
+        except KeyError:
+            pass
+
+        dest, comp, jump = split_c_instruction(command)
+
+        # C instructions always start with 111 bits
+        word = (0b111 << 13 |
+                Code._lookup(COMP_TABLE, comp, 'comp') << 6 |
+                Code._lookup(DEST_TABLE, dest, 'dest') << 3 |
+                Code._lookup(JUMP_TABLE, jump, 'jump'))
+
+        _c_instruction_cache[command] = word
+        return word
+
+    @staticmethod
+    def _lookup(table, mnemonic, field):
+        try:
+            return table[mnemonic]
+        except KeyError:
+            raise ValueError(
+                '"{0}" is an invalid {1} mnemonic.'.format(mnemonic, field))
+
+
+def peephole(lines):
+    """
+    Remove provably redundant instructions from Hack assembly before it is
+    encoded. Works on basic blocks: everything known about the registers is
+    forgotten at every label and at every numeric jump target, and the
+    rewrites only rely on what the block itself established:
+
+    - `@X` when A already holds X
+    - `@X` immediately followed by another A-instruction (A is overwritten)
+    - `D=A` / `A=D` when both registers already hold the same value
+    - `M=M+1` immediately followed by `M=M-1` on the same address, or the
+      other way round
+
+    Jumps to numeric ROM addresses (`@133` / `0;JMP`, as emitted by the
+    official Jack tool chain) are relocated to match the shortened program.
+    Code addresses used as data are assumed to be labels, which is the case
+    for all compiler and VM translator output; if a numeric jump target is
+    also read as data by the jump itself the program is left untouched.
+
+    Returns the optimized commands without comments and the number of
+    instructions removed. Labels are resolved afterwards by the normal passes.
+    """
+    commands = [command for command in (strip_line(line) for line in lines) if command]
+
+    # An A-instruction that feeds a jump holds a ROM address: that address is
+    # a jump target and the A-instruction has to be relocated
+    instructions = [command for command in commands if command[0] != '(']
+    providers = set()  # old ROM addresses of A-instructions that feed a jump
+    targets = set()  # old ROM addresses that numeric jumps land on
+
+    for address, command in enumerate(instructions[:-1]):
+        if command[0] != '@' or not command[1:].isdigit():
+            continue
+
+        next_command = instructions[address + 1]
+        if next_command[0] == '@':
+            continue
+
+        _, comp, jump = split_c_instruction(next_command)
+        if not jump:
+            continue
+        if 'A' in comp or 'M' in comp:
+            return commands, 0
+
+        providers.add(address)
+        targets.add(int(command[1:]))
+
+    out = []  # (command, old ROM address or None for labels)
+    known_a = known_d = None
+    address = -1
+
+    for command in commands:
+        if command[0] == '(':
+            out.append((command, None))
+            known_a = known_d = None
+            continue
+
+        address += 1
+        if address in targets:
+            known_a = known_d = None
+
+        if command[0] == '@':
+            value = command[1:]
+
+            if value == known_a and address not in providers:
+                continue
+
+            # The previous A-instruction was never used
+            if out and out[-1][1] is not None and out[-1][0][0] == '@':
+                out.pop()
+
+            # A ROM address isn't the same value as the equal data constant
+            known_a = None if address in providers else value
+            out.append((command, address))
+            continue
+
+        dest, comp, jump = split_c_instruction(command)
+
+        if not jump:
+            if (command in ('D=A', 'A=D') and known_a is not None and known_a == known_d):
+                continue
+
+            if (command in ('M=M-1', 'M=M+1') and address not in targets and out and
+                    out[-1][0] == ('M=M+1' if command == 'M=M-1' else 'M=M-1')):
+                out.pop()
+                continue
+
+        new_a = known_a
+        if 'A' in dest:
+            new_a = known_d if comp == 'D' else None
+
+        new_d = known_d
+        if 'D' in dest:
+            new_d = known_a if comp == 'A' else None
+
+        known_a, known_d = new_a, new_d
+        out.append((command, address))
+
+    # Old ROM address -> address of the first instruction that survived at or after it
+    new_addresses = [0] * (len(instructions) + 1)
+    new_address = 0
+    next_old = 0
+    for _, old in out:
+        if old is None:
+            continue
+        while next_old <= old:
+            new_addresses[next_old] = new_address
+            next_old += 1
+        new_address += 1
+    while next_old <= len(instructions):
+        new_addresses[next_old] = new_address
+        next_old += 1
+
+    optimized = []
+    for command, old in out:
+        if old in providers:
+            target = int(command[1:])
+            command = '@{}'.format(new_addresses[min(target, len(instructions))])
+        optimized.append(command)
+
+    return optimized, len(instructions) - new_address
+
+
+# SP, LCL, ARG, THIS, THAT, R0-R15, SCREEN and KBD
+PREDEFINED_SYMBOL_COUNT = 23
 
 
 class SymbolTable:
@@ -301,8 +611,360 @@ class SymbolTable:
         return self.table[symbol]
 
 
+class Stats:
+    """
+    Opt-in instrumentation for the assembler: wall time and call count per
+    phase, plus a summary of the assembled program
+    """
+
+    def __init__(self):
+        self.phases = dict()  # phase -> [seconds, calls]
+        self.counts = dict()
+
+    def wrap(self, phase, function):
+        """
+        Return `function` wrapped so that every call is timed under `phase`
+        """
+        record = self.phases.setdefault(phase, [0.0, 0])
+        perf_counter = time.perf_counter
+
+        def timed(*args):
+            start = perf_counter()
+            try:
+                return function(*args)
+            finally:
+                record[0] += perf_counter() - start
+                record[1] += 1
+
+        return timed
+
+    def add_time(self, phase, start):
+        record = self.phases.setdefault(phase, [0.0, 0])
+        record[0] += time.perf_counter() - start
+        record[1] += 1
+
+    def count_program(self, words, symbol_table, variable_count):
+        # Every C-instruction goes through the encoder exactly once
+        c_commands = self.phases.get('encode', [0.0, 0])[1] - self.counts.get('C_COMMAND', 0)
+        labels = len(symbol_table.table) - PREDEFINED_SYMBOL_COUNT - variable_count
+
+        self.counts['A_COMMAND'] = self.counts.get('A_COMMAND', 0) + len(words) - c_commands
+        self.counts['C_COMMAND'] = self.counts.get('C_COMMAND', 0) + c_commands
+        self.counts['L_COMMAND'] = self.counts.get('L_COMMAND', 0) + labels
+        self.counts['variables'] = self.counts.get('variables', 0) + variable_count
+        self.counts['symbols'] = self.counts.get('symbols', 0) + len(symbol_table.table)
+
+    def report(self):
+        return {
+            'phases': {phase: {'seconds': seconds, 'calls': calls}
+                       for phase, (seconds, calls) in self.phases.items()},
+            'counts': dict(self.counts),
+        }
+
+    def format(self):
+        lines = ['{0:<12} {1:>10} {2:>10}'.format('phase', 'seconds', 'calls')]
+        for phase, (seconds, calls) in self.phases.items():
+            lines.append('{0:<12} {1:>10.4f} {2:>10}'.format(phase, seconds, calls))
+
+        lines.append('')
+        for name, count in self.counts.items():
+            lines.append('{0:<12} {1:>10}'.format(name, count))
+
+        return '\n'.join(lines)
+
+
+def assemble(source, stats=None, optimize=False):
+    """
+    Assemble Hack assembly held in memory. `source` is either the whole
+    program as a string, an iterable of lines or a file object. With
+    `optimize`, the peephole optimizer runs first.
+    Returns an array('H') of instruction words and the final SymbolTable.
+    """
+    if isinstance(source, str):
+        source = source.splitlines()
+
+    return Parser().assemble(source, stats=stats, optimize=optimize)
+
+
+def write_hack(words, path):
+    """
+    Write instruction words as a .hack text file, one 16-bit binary string per line
+    """
+    with open(path, 'w') as hack_file:
+        hack_file.write(''.join('{0:016b}\n'.format(word) for word in words))
+
+
+# .hackbin layout (all little-endian):
+#   header: magic, number of instruction words (HACKBIN_STREAMED when
+#           written by a stream), offset of the symbol table section or 0
+#           when there is none
+#   words:  one uint16 per instruction, starting right after the header
+#   symbols (optional): `symbol address` text lines, utf-8 encoded
+HACKBIN_MAGIC = b'HACK'
+HACKBIN_HEADER = struct.Struct('<4sII')
+# Word count of a streamed image: the words run to the end of the file
+HACKBIN_STREAMED = 0xffffffff
+
+
+def write_hackbin(words, path, symbol_table=None):
+    """
+    Write instruction words as a raw .hackbin image, optionally followed by
+    the symbol table
+    """
+    words = array('H', words)
+    if sys.byteorder != 'little':
+        words.byteswap()
+
+    symbol_table_offset = 0
+    if symbol_table is not None:
+        symbol_table_offset = HACKBIN_HEADER.size + len(words) * words.itemsize
+
+    with open(path, 'wb') as hackbin_file:
+        hackbin_file.write(HACKBIN_HEADER.pack(
+            HACKBIN_MAGIC, len(words), symbol_table_offset))
+        hackbin_file.write(words.tobytes())
+
+        if symbol_table is not None:
+            hackbin_file.write(''.join(
+                '{0} {1}\n'.format(symbol, address)
+                for symbol, address in symbol_table.table.items()).encode('utf-8'))
+
+
+def load_hackbin(path):
+    """
+    Map a .hackbin image into memory. Returns the instruction words as a
+    read-only memoryview of uint16 backed directly by the mapping, and the
+    embedded SymbolTable or None.
+    """
+    with open(path, 'rb') as hackbin_file:
+        image = mmap.mmap(hackbin_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if len(image) < HACKBIN_HEADER.size:
+        raise ValueError('"{}" is not a .hackbin image.'.format(path))
+
+    magic, word_count, symbol_table_offset = HACKBIN_HEADER.unpack_from(image)
+    if word_count == HACKBIN_STREAMED:
+        word_count = (len(image) - HACKBIN_HEADER.size) // 2
+    words_end = HACKBIN_HEADER.size + 2 * word_count
+    if magic != HACKBIN_MAGIC or words_end > len(image):
+        raise ValueError('"{}" is not a .hackbin image.'.format(path))
+
+    words = memoryview(image)[HACKBIN_HEADER.size:words_end]
+    if sys.byteorder == 'little':
+        words = words.cast('H')
+    else:
+        # The image is little-endian, so big-endian hosts have to copy once
+        words = array('H', words.tobytes())
+        words.byteswap()
+
+    symbol_table = None
+    if symbol_table_offset:
+        symbol_table = SymbolTable()
+        for line in image[symbol_table_offset:].decode('utf-8').splitlines():
+            symbol, address = line.rsplit(' ', 1)
+            symbol_table.add_entry(symbol, int(address))
+
+    return words, symbol_table
+
+
+def assemble_stream(source, output, binary=False):
+    """
+    Assemble a stream of Hack assembly lines (e.g. sys.stdin) and write the
+    result to `output` as it becomes available: .hack text lines to a text
+    stream, or a .hackbin image to a binary stream. Returns the number of
+    instructions written and the final SymbolTable.
+    An `output` that can seek, like a file, gets every word as soon as it is
+    read and the forward references patched at the end. Otherwise, like a
+    pipe, the words from the first forward reference onwards wait for it to
+    resolve (see `Parser.stream`).
+    """
+    parser = Parser()
+    instruction_count = 0
+
+    backpatch = output.seekable()
+    start = output.tell() if backpatch else 0
+
+    if binary:
+        # The word count isn't known up front, so the image is marked as
+        # running to the end of the stream
+        output.write(HACKBIN_HEADER.pack(HACKBIN_MAGIC, HACKBIN_STREAMED, 0))
+
+    for words in parser.stream(source, backpatch=backpatch):
+        if binary:
+            if sys.byteorder != 'little':
+                words.byteswap()
+            output.write(words.tobytes())
+        else:
+            output.write(''.join('{0:016b}\n'.format(word) for word in words))
+
+        instruction_count += len(words)
+
+    if parser.patches:
+        end = output.tell()
+        if binary:
+            for address, value in parser.patches:
+                output.seek(start + HACKBIN_HEADER.size + 2 * address)
+                output.write(struct.pack('<H', value))
+        else:
+            # Every line has the same length, line ending included
+            line_size = (end - start) // instruction_count
+            for address, value in parser.patches:
+                output.seek(start + line_size * address)
+                output.write('{0:016b}'.format(value))
+        output.seek(end)
+
+    output.flush()
+
+    return instruction_count, parser.symbol_table
+
+
+def find_asm_files(paths):
+    """
+    Expand files and directory trees into a sorted list of .asm files
+    """
+    asm_files = []
+
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, _, filenames in os.walk(path):
+                asm_files.extend(os.path.join(directory, filename)
+                                 for filename in filenames if filename.endswith('.asm'))
+        else:
+            asm_files.append(path)
+
+    return sorted(asm_files)
+
+
+def _assemble_file(file, options):
+    """
+    Batch worker: assemble one file and return (file, instruction count, error).
+    Errors are reported as strings so one bad file doesn't stop the batch.
+    """
+    try:
+        return file, len(Parser(file, **options).words), None
+    except (Exception, ArgumentError) as error:
+        return file, 0, '{0}: {1}'.format(type(error).__name__, error)
+
+
+def assemble_batch(paths, workers=None, **options):
+    """
+    Assemble every .asm file found in `paths` with a pool of `workers`
+    processes (one per CPU by default). Returns one (file, instruction count,
+    error) tuple per file, in sorted file order regardless of scheduling.
+    """
+    asm_files = find_asm_files(paths)
+
+    if workers == 1 or len(asm_files) <= 1:
+        return [_assemble_file(file, options) for file in asm_files]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_assemble_file, asm_files,
+                                 itertools.repeat(options), chunksize=4))
+
+
 if __name__ == '__main__':
-    import sys
+    import argparse
+
+    arg_parser = argparse.ArgumentParser(
+        description='Translate Hack assembly (.asm) into Hack machine code (.hack)')
+    arg_parser.add_argument('files', nargs='*', metavar='file.asm',
+                            help='.asm files, or directories when used with --batch')
+    arg_parser.add_argument('--binary', action='store_true',
+                            help='write a raw .hackbin image instead of .hack text')
+    arg_parser.add_argument('--symbols', action='store_true',
+                            help='embed the symbol table in the .hackbin image')
+    arg_parser.add_argument('--batch', action='store_true',
+                            help='assemble files and directory trees in parallel and print a summary')
+    arg_parser.add_argument('-j', '--jobs', type=int, default=None,
+                            help='number of worker processes in batch mode (default and 0: one per CPU)')
+    arg_parser.add_argument('--stream', action='store_true',
+                            help='read assembly from stdin and write the result to stdout. '
+                                 'Redirected to a file, stdout gets words as they are read and '
+                                 'forward references patched at the end. Through a pipe, '
+                                 'everything after the first reference to a symbol that is not '
+                                 'defined yet waits for it, up to the end for variables.')
+    arg_parser.add_argument('--cache', action='store_true',
+                            help='reuse results cached in ~/.cache/nand2tetris, also on when '
+                                 'NAND2TETRIS_CACHE_DIR names another directory')
+    arg_parser.add_argument('--no-cache', action='store_true',
+                            help='always reassemble, even with NAND2TETRIS_CACHE_DIR set')
+    arg_parser.add_argument('--stats', action='store_true',
+                            help='print per-phase timings and program counts to stderr')
+    arg_parser.add_argument('--stats-json', metavar='stats.json',
+                            help='write per-phase timings and program counts as JSON')
+    arg_parser.add_argument('--optimize', action='store_true',
+                            help='remove redundant instructions before encoding')
+    args = arg_parser.parse_args()
+
+    if args.optimize and args.stream:
+        arg_parser.error('--optimize needs the whole program and cannot stream')
+
+    if (args.stats or args.stats_json) and (args.stream or args.batch):
+        arg_parser.error('--stats only works when assembling files one by one')
+
+    if args.stream:
+        if args.files:
+            arg_parser.error('--stream reads from stdin and takes no files')
+
+        assemble_stream(sys.stdin, sys.stdout.buffer if args.binary else sys.stdout,
+                        binary=args.binary)
+        sys.exit(0)
+
+    if not args.files:
+        arg_parser.error('no input files given')
+
+    # The cache is opt-in, it writes outside the project
+    cache = None
+    if (args.cache or os.environ.get('NAND2TETRIS_CACHE_DIR')) and not args.no_cache:
+        # Only imported when used, so this file also runs on its own
+        try:
+            from BuildCache import BuildCache, tool_version
+        except ImportError:
+            pass
+        else:
+            cache = BuildCache('assembler', tool_version(__file__))
+
+    options = dict(binary=args.binary, symbols=args.symbols, cache=cache,
+                   optimize=args.optimize)
+
+    if args.batch:
+        start = time.perf_counter()
+        results = assemble_batch(args.files, workers=args.jobs or None, **options)
+        elapsed = time.perf_counter() - start
+
+        failures = 0
+        instructions = 0
+        for file, instruction_count, error in results:
+            if error is not None:
+                failures += 1
+                print('{0}: {1}'.format(file, error), file=sys.stderr)
+            instructions += instruction_count
+
+        print('{0} files ({1} failed), {2} instructions in {3:.3f}s ({4:.0f} instructions/s)'.format(
+            len(results), failures, instructions, elapsed,
+            instructions / elapsed if elapsed else 0))
+
+        sys.exit(1 if failures else 0)
+
+    stats = None
+    if args.stats or args.stats_json:
+        # Cached results would skip everything worth measuring
+        stats = Stats()
+        options['cache'] = None
+
+    for arg in args.files:
+        parser = Parser(arg, stats=stats, **options)
+
+        if args.optimize:
+            print('{0}: removed {1} of {2} instructions'.format(
+                arg, parser.removed_instructions,
+                len(parser.words) + parser.removed_instructions), file=sys.stderr)
+
+    if args.stats:
+        print(stats.format(), file=sys.stderr)
+
+    if args.stats_json:
+        import json
 
-    for arg in sys.argv[1:]:
-        Parser(arg)
+        with open(args.stats_json, 'w') as stats_file:
+            json.dump(stats.report(), stats_file, indent=2)
@@ -0,0 +1,310 @@
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+from Assembler import COMP_TABLE, DEST_TABLE, JUMP_TABLE, Stats, assemble, write_hack
+from CPUEmulator import CPU
+
+
+PROJECTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+# Programs shipped with the repo that the suite always runs
+REPO_PROGRAMS = [
+    os.path.join('04', 'fill', 'Fill.asm'),
+    os.path.join('04', 'mult', 'mult.asm'),
+    os.path.join('06', 'add', 'Add.asm'),
+    os.path.join('06', 'max', 'Max.asm'),
+    os.path.join('06', 'max', 'MaxL.asm'),
+    os.path.join('06', 'rect', 'Rect.asm'),
+    os.path.join('06', 'rect', 'RectL.asm'),
+    os.path.join('06', 'pong', 'Pong.asm'),
+    os.path.join('06', 'pong', 'PongL.asm'),
+]
+
+SYNTHETIC_SIZES = [10000, 100000, 1000000]
+# Synthetic labels are declared within this many lines so they fit in ROM
+LABEL_REGION = 30000
+
+# Emulator workloads: program, initial RAM, cycle budget
+EMULATOR_PROGRAMS = [
+    (os.path.join('04', 'mult', 'mult.asm'), {0: 123, 1: 30000}, 10000000),
+    (os.path.join('06', 'pong', 'Pong.asm'), {}, 5000000),
+]
+
+# Programs whose blocks end in unusual ways, only checked for the same end
+# state under the interpreter and the JIT: (description, source, cycles)
+EMULATOR_CHECKS = [
+    ('A-instructions up to the end of the program', '@2\n0;JMP\n@5\n', 10),
+    ('nothing but A-instructions', '@1\n@2\n@3\n', 100000),
+    ('a long run of A-instructions', '@7\n' * 300 + 'D=A\n', 1000),
+]
+
+# Assembler options measured by the suite, named as in earlier reports so
+# they can still be compared against
+MODES = {
+    'two-pass': {},
+}
+
+
+def generate_program(lines, label_density=0.02, variable_density=0.1,
+                     comment_density=0.1, seed=0):
+    """
+    Generate a synthetic Hack assembly program of `lines` source lines.
+    The densities are the fraction of lines that are label declarations,
+    A-instructions referencing variables and comment lines. The rest is an
+    even mix of label references, constants and C-instructions.
+    Labels can only point into the 32K instruction ROM, so they are all
+    declared within the first LABEL_REGION lines; references to them are
+    spread over the whole program, both before and after the declaration.
+    """
+    rng = random.Random(seed)
+
+    label_region = min(lines, LABEL_REGION)
+    label_count = max(1, int(label_region * label_density))
+    label_lines = set(rng.sample(range(label_region), label_count))
+    # Variables live in RAM[16..16383]
+    variable_count = min(max(1, int(lines * variable_density) // 8), 16384 - 16)
+    comps = sorted(COMP_TABLE)
+    dests = sorted(DEST_TABLE)
+    jumps = sorted(JUMP_TABLE)
+
+    program = []
+    next_label = 0
+
+    for line in range(lines):
+        draw = rng.random()
+
+        if line in label_lines:
+            program.append('(LABEL.{})'.format(next_label))
+            next_label += 1
+        elif draw < comment_density:
+            program.append('// synthetic comment {}'.format(rng.randrange(1000)))
+        elif draw < comment_density + variable_density:
+            program.append('@var.{}'.format(rng.randrange(variable_count)))
+        else:
+            kind = rng.randrange(3)
+
+            if kind == 0:
+                program.append('@LABEL.{}'.format(rng.randrange(label_count)))
+            elif kind == 1:
+                program.append('@{}'.format(rng.randrange(0x8000)))
+            else:
+                dest = rng.choice(dests)
+                jump = rng.choice(jumps)
+                program.append('    {0}{1}{2}{3}'.format(
+                    dest + '=' if dest else '', rng.choice(comps),
+                    ';' + jump if jump else '',
+                    '  // inline comment' if rng.random() < comment_density else ''))
+
+    return [line + '\n' for line in program]
+
+
+def measure(name, lines, repeat=3, **options):
+    """
+    Assemble `lines` `repeat` times and report the best time of each phase:
+    assembling in memory and writing the .hack text. Peak memory and the
+    assembler's internal phases are measured on separate runs since tracing
+    and instrumentation slow everything down.
+    """
+    work_dir = tempfile.mkdtemp()
+    hack_path = os.path.join(work_dir, 'Prog.hack')
+
+    try:
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            words, symbol_table = assemble(lines, **options)
+            assembled = time.perf_counter()
+            write_hack(words, hack_path)
+            written = time.perf_counter()
+
+            phases = {'assemble': assembled - start, 'write': written - assembled}
+            if best is None or sum(phases.values()) < sum(best.values()):
+                best = phases
+
+        stats = Stats()
+        assemble(lines, stats=stats, **options)
+
+        tracemalloc.start()
+        words, symbol_table = assemble(lines, **options)
+        write_hack(words, hack_path)
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        shutil.rmtree(work_dir)
+
+    seconds = sum(best.values())
+
+    return {
+        'program': name,
+        'lines': len(lines),
+        'instructions': len(words),
+        'symbols': len(symbol_table.table),
+        'seconds': seconds,
+        'lines_per_second': len(lines) / seconds if seconds else None,
+        'peak_memory': peak_memory,
+        'phases': best,
+        'assembler': stats.report(),
+    }
+
+
+def run_suite(sizes=SYNTHETIC_SIZES, repeat=3, label_density=0.02,
+              variable_density=0.1, comment_density=0.1):
+    results = []
+
+    programs = []
+    for program in REPO_PROGRAMS:
+        with open(os.path.join(PROJECTS, program), 'r') as asm_file:
+            programs.append((program, asm_file.readlines()))
+
+    for size in sizes:
+        programs.append(('synthetic-{}'.format(size), generate_program(
+            size, label_density=label_density,
+            variable_density=variable_density, comment_density=comment_density)))
+
+    for name, lines in programs:
+        for mode, options in MODES.items():
+            result = measure(name, lines, repeat=repeat, **options)
+            result['mode'] = mode
+            results.append(result)
+
+            print('{0:<28} {1:<12} {2:>8} lines {3:>9.4f}s {4:>12.0f} lines/s {5:>8.1f} MB'.format(
+                name, mode, result['lines'], result['seconds'],
+                result['lines_per_second'] or 0, result['peak_memory'] / 1e6))
+
+    return results
+
+
+def current_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=PROJECTS,
+            stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_reports(baseline, report):
+    """
+    Print the speedup of every program/mode in `report` against `baseline`
+    """
+    previous = {(result['program'], result['mode']): result
+                for result in baseline['results']}
+
+    print('\nCompared to {}:'.format(baseline.get('commit')))
+    for result in report['results']:
+        before = previous.get((result['program'], result['mode']))
+        if before is None or not result['seconds']:
+            continue
+
+        print('{0:<28} {1:<12} {2:>6.2f}x'.format(
+            result['program'], result['mode'], before['seconds'] / result['seconds']))
+
+
+def check_emulators():
+    """
+    Check that the interpreter and the block compiler end in the same state
+    on EMULATOR_CHECKS
+    """
+    for description, source, cycles in EMULATOR_CHECKS:
+        words, _ = assemble(source)
+
+        states = {}
+        for method in ('run', 'run_jit'):
+            cpu = CPU(words)
+            getattr(cpu, method)(cycles)
+            states[method] = (cpu.ram.tobytes(), cpu.a, cpu.d, cpu.pc, cpu.cycles)
+
+        if states['run'] != states['run_jit']:
+            raise AssertionError('JIT and interpreter states differ on ' + description)
+
+
+def compare_emulators(repeat=3):
+    """
+    Time the interpreter against the block compiler on EMULATOR_PROGRAMS and
+    check that both end in the same state, after the EMULATOR_CHECKS
+    """
+    check_emulators()
+
+    for program, ram, cycles in EMULATOR_PROGRAMS:
+        with open(os.path.join(PROJECTS, program), 'r') as asm_file:
+            words, _ = assemble(asm_file)
+
+        timings = {}
+        states = {}
+        for method in ('run', 'run_jit'):
+            best = None
+            for _ in range(repeat):
+                cpu = CPU(words)
+                for address, value in ram.items():
+                    cpu.ram[address] = value
+
+                start = time.perf_counter()
+                getattr(cpu, method)(cycles, halt=True)
+                elapsed = time.perf_counter() - start
+
+                if best is None or elapsed < best:
+                    best = elapsed
+
+            timings[method] = best
+            states[method] = (cpu.ram.tobytes(), cpu.a, cpu.d, cpu.pc, cpu.cycles)
+
+        if states['run'] != states['run_jit']:
+            raise AssertionError('JIT and interpreter states differ for ' + program)
+
+        executed = states['run'][-1]
+        print('{0}: {1} instructions'.format(program, executed))
+        print('  interpreter: {0:.4f}s {1:>6.2f} MIPS'.format(
+            timings['run'], executed / timings['run'] / 1e6))
+        print('  jit:         {0:.4f}s {1:>6.2f} MIPS ({2:.2f}x)'.format(
+            timings['run_jit'], executed / timings['run_jit'] / 1e6,
+            timings['run'] / timings['run_jit']))
+
+
+if __name__ == '__main__':
+    import argparse
+
+    arg_parser = argparse.ArgumentParser(
+        description='Measure assembler throughput on the repo programs and synthetic ones')
+    arg_parser.add_argument('--emulator', action='store_true',
+                            help='only compare the emulator interpreter and JIT')
+    arg_parser.add_argument('--sizes', nargs='*', type=int, default=SYNTHETIC_SIZES,
+                            help='line counts of the synthetic programs')
+    arg_parser.add_argument('--label-density', type=float, default=0.02)
+    arg_parser.add_argument('--variable-density', type=float, default=0.1)
+    arg_parser.add_argument('--comment-density', type=float, default=0.1)
+    arg_parser.add_argument('--repeat', type=int, default=3,
+                            help='runs per measurement, the best one is reported')
+    arg_parser.add_argument('--output', metavar='results.json',
+                            help='write the results as JSON')
+    arg_parser.add_argument('--compare', metavar='baseline.json',
+                            help='print speedups against results of an earlier run')
+    args = arg_parser.parse_args()
+
+    if args.emulator:
+        compare_emulators(repeat=args.repeat)
+    else:
+        report = {
+            'commit': current_commit(),
+            'python': platform.python_version(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'results': run_suite(
+                sizes=args.sizes, repeat=args.repeat,
+                label_density=args.label_density,
+                variable_density=args.variable_density,
+                comment_density=args.comment_density),
+        }
+
+        if args.output:
+            with open(args.output, 'w') as output_file:
+                json.dump(report, output_file, indent=2)
+
+        if args.compare:
+            with open(args.compare, 'r') as baseline_file:
+                compare_reports(json.load(baseline_file), report)
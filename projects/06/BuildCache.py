@@ -0,0 +1,165 @@
+import hashlib
+import json
+import os
+import time
+
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'nand2tetris')
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024  # bytes
+# Eviction goes down to this fraction of the maximum size, so that the cache
+# directory isn't scanned again on the next writes
+EVICTION_TARGET = 0.75
+# Temporary files older than this are left over from writes that never
+# finished, younger ones may still be written by another process
+STALE_TEMPORARY_AGE = 3600  # seconds
+
+
+def tool_version(tool_file):
+    """
+    Version of a tool for cache keys: the hash of its own source, so that any
+    change to the tool invalidates everything it produced before
+    """
+    with open(tool_file, 'rb') as source:
+        return hashlib.sha256(source.read()).hexdigest()
+
+
+class BuildCache:
+    """
+    On-disk cache of tool outputs keyed by a hash of the tool version and the
+    input content. Every entry is a small JSON file; the least recently used
+    entries are evicted once the cache grows past `max_size` bytes.
+    The directory is scanned once when the cache is opened, after that its
+    size is tracked as entries are written and it is only scanned again to
+    evict.
+    """
+
+    def __init__(self, tool, version, directory=None, max_size=DEFAULT_MAX_SIZE):
+        self.tool = tool
+        self.version = version
+        self.directory = directory or os.environ.get(
+            'NAND2TETRIS_CACHE_DIR', DEFAULT_CACHE_DIR)
+        self.max_size = max_size
+
+        self.hits = 0
+        self.misses = 0
+
+        self._size = 0
+        if os.path.isdir(self.directory):
+            self._size = self._scan()[1]
+
+    def key(self, *contents):
+        """
+        Hash the tool name, its version and every piece of input content
+        """
+        digest = hashlib.sha256()
+        digest.update(self.tool.encode('utf-8'))
+        digest.update(self.version.encode('utf-8'))
+
+        for content in contents:
+            if isinstance(content, str):
+                content = content.encode('utf-8')
+            # Length prefix so ('ab', 'c') and ('a', 'bc') hash differently
+            digest.update(str(len(content)).encode('ascii') + b':')
+            digest.update(content)
+
+        return digest.hexdigest()
+
+    def get(self, key):
+        """
+        Return the entry stored under `key`, or None on a miss
+        """
+        path = self._path(key)
+
+        try:
+            with open(path, 'r') as entry_file:
+                entry = json.load(entry_file)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+
+        # Bump the access time used for LRU eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+        self.hits += 1
+        return entry
+
+    def put(self, key, entry):
+        """
+        Store a JSON-serializable entry under `key` and evict old entries if
+        the cache is over its size limit
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+
+        # Write to a private file first so concurrent readers never see a
+        # half-written entry
+        temporary_path = '{0}.{1}.tmp'.format(path, os.getpid())
+        try:
+            with open(temporary_path, 'w') as entry_file:
+                json.dump(entry, entry_file, separators=(',', ':'))
+            os.replace(temporary_path, path)
+        except BaseException:
+            try:
+                os.remove(temporary_path)
+            except OSError:
+                pass
+            raise
+
+        # Replacing an entry counts it twice until the next scan, which only
+        # makes eviction come a little early
+        self._size += os.path.getsize(path)
+        if self._size > self.max_size:
+            self._evict()
+
+    def _path(self, key):
+        return os.path.join(self.directory, '{0}-{1}.json'.format(self.tool, key))
+
+    def _scan(self):
+        """
+        (mtime, size, path) of every entry and their total size. Temporary
+        files left over by failed writes are removed on the way.
+        """
+        entries = []
+        total_size = 0
+        now = time.time()
+
+        for filename in os.listdir(self.directory):
+            path = os.path.join(self.directory, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue  # Evicted by another process in the meantime
+
+            if filename.endswith('.tmp'):
+                if now - stat.st_mtime > STALE_TEMPORARY_AGE:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                continue
+            if not filename.endswith('.json'):
+                continue
+
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total_size += stat.st_size
+
+        return entries, total_size
+
+    def _evict(self):
+        entries, total_size = self._scan()
+
+        # Oldest first
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size * EVICTION_TARGET:
+                break
+
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total_size -= size
+
+        self._size = total_size
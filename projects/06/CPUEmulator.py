@@ -0,0 +1,488 @@
+import os
+import time
+from array import array
+
+from Assembler import assemble, load_hackbin
+
+
+RAM_SIZE = 32768
+ROM_SIZE = 32768
+SCREEN = 16384
+SCREEN_SIZE = 8192
+KBD = 24576
+
+# Pre-decoded opcodes. C-instructions use their 7-bit comp field (the `a`
+# bit followed by c1..c6) as opcode, A-instructions and the ROM wrap-around
+# get negative opcodes so a single comparison tells them apart.
+A_INSTRUCTION = -1
+WRAP = -2
+
+# dest bits
+DEST_A = 0b100
+DEST_D = 0b010
+DEST_M = 0b001
+
+# jump bits
+JUMP_LT = 0b100
+JUMP_EQ = 0b010
+JUMP_GT = 0b001
+
+# Python source of every comp mnemonic for the block compiler. `{a}` and
+# `{m}` are replaced by either a constant or the A / RAM[A] lookup.
+COMP_SOURCE = {
+    0b0101010: '0',
+    0b0111111: '1',
+    0b0111010: '65535',
+    0b0001100: 'd',
+    0b0110000: '{a}',
+    0b1110000: '{m}',
+    0b0001101: '~d & 65535',
+    0b0110001: '~{a} & 65535',
+    0b1110001: '~{m} & 65535',
+    0b0001111: '-d & 65535',
+    0b0110011: '-{a} & 65535',
+    0b1110011: '-{m} & 65535',
+    0b0011111: '(d + 1) & 65535',
+    0b0110111: '({a} + 1) & 65535',
+    0b1110111: '({m} + 1) & 65535',
+    0b0001110: '(d - 1) & 65535',
+    0b0110010: '({a} - 1) & 65535',
+    0b1110010: '({m} - 1) & 65535',
+    0b0000010: '(d + {a}) & 65535',
+    0b1000010: '(d + {m}) & 65535',
+    0b0010011: '(d - {a}) & 65535',
+    0b1010011: '(d - {m}) & 65535',
+    0b0000111: '({a} - d) & 65535',
+    0b1000111: '({m} - d) & 65535',
+    0b0000000: 'd & {a}',
+    0b1000000: 'd & {m}',
+    0b0010101: 'd | {a}',
+    0b1010101: 'd | {m}',
+}
+
+# Python source of the jump conditions on the ALU output `t`
+JUMP_SOURCE = {
+    0b001: '0 < t < 32768',
+    0b010: 't == 0',
+    0b011: 't < 32768',
+    0b100: 't >= 32768',
+    0b101: 't != 0',
+    0b110: 't == 0 or t >= 32768',
+}
+
+# Longest straight-line run compiled into one block
+MAX_BLOCK_LENGTH = 256
+
+
+def load_rom(path):
+    """
+    Load a program as an array of instruction words from a .hack text file,
+    a .hackbin image or an .asm source file
+    """
+    extension = os.path.splitext(path)[1]
+
+    if extension == '.hackbin':
+        return array('H', load_hackbin(path)[0])
+
+    if extension == '.asm':
+        with open(path, 'r') as asm_file:
+            return assemble(asm_file)[0]
+
+    with open(path, 'r') as hack_file:
+        return array('H', [int(line, 2) for line in (line.strip() for line in hack_file) if line])
+
+
+def alu(comp, a, d, m):
+    """
+    Evaluate any 7-bit comp field the way the Hack ALU does, including the
+    combinations that have no assembly mnemonic
+    """
+    x = d
+    y = m if comp & 0b1000000 else a
+
+    if comp & 0b100000:  # zx
+        x = 0
+    if comp & 0b010000:  # nx
+        x = ~x & 0xffff
+    if comp & 0b001000:  # zy
+        y = 0
+    if comp & 0b000100:  # ny
+        y = ~y & 0xffff
+
+    if comp & 0b000010:  # f
+        out = (x + y) & 0xffff
+    else:
+        out = x & y
+
+    if comp & 0b000001:  # no
+        out = ~out & 0xffff
+
+    return out
+
+
+class CPU:
+    """
+    Headless Hack computer: 32K ROM, 32K RAM with the screen and keyboard
+    memory maps, and a cycle counter. The ROM is decoded once into parallel
+    lists of opcode, A-instruction value, dest mask and jump mask so the
+    interpreter loop never has to look at instruction bits.
+    """
+
+    def __init__(self, rom=()):
+        self.ram = array('H', bytes(2 * RAM_SIZE))
+        self.a = 0
+        self.d = 0
+        self.pc = 0
+        self.cycles = 0
+
+        self.load(rom)
+
+    def load(self, words):
+        """
+        Load instruction words into ROM and decode them
+        """
+        if len(words) > ROM_SIZE:
+            raise ValueError('Program of {} instructions does not fit in ROM'.format(len(words)))
+
+        self.rom = array('H', words)
+
+        # The rest of the ROM is zeros, i.e. `@0`. One extra slot past the
+        # end sends the program counter back to 0.
+        padding = ROM_SIZE - len(words)
+        self._ops = [A_INSTRUCTION if not word & 0x8000 else word >> 6 & 0b1111111
+                     for word in words] + [A_INSTRUCTION] * padding + [WRAP]
+        self._values = [word if not word & 0x8000 else 0 for word in words] + [0] * (padding + 1)
+        self._dests = [word >> 3 & 0b111 if word & 0x8000 else 0
+                       for word in words] + [0] * (padding + 1)
+        self._jumps = [word & 0b111 if word & 0x8000 else 0
+                       for word in words] + [0] * (padding + 1)
+
+        # `(END) @END 0;JMP`: jumping back to an A-instruction that loads its own address
+        self._halts = set(address for address, word in enumerate(words)
+                          if word == address and address + 1 < len(words) and
+                          self._jumps[address + 1] == 0b111)
+
+        # Compiled blocks and their lengths, by start address (see `run_jit`)
+        self._blocks = [None] * (ROM_SIZE + 1)
+        self._block_lengths = [0] * (ROM_SIZE + 1)
+
+        self.reset()
+
+    def reset(self):
+        """
+        Reset the registers and the cycle counter, RAM is left untouched
+        """
+        self.a = 0
+        self.d = 0
+        self.pc = 0
+        self.cycles = 0
+
+    @property
+    def screen(self):
+        return memoryview(self.ram)[SCREEN:SCREEN + SCREEN_SIZE]
+
+    @property
+    def keyboard(self):
+        return self.ram[KBD]
+
+    @keyboard.setter
+    def keyboard(self, key):
+        self.ram[KBD] = key
+
+    def run(self, cycles, halt=False):
+        """
+        Execute up to `cycles` instructions. With `halt`, stop early once the
+        program enters its final `(END) @END 0;JMP` loop.
+        Returns the number of instructions executed.
+        """
+        ops = self._ops
+        values = self._values
+        dests = self._dests
+        jumps = self._jumps
+        halts = self._halts if halt else ()
+        ram = self.ram
+        a = self.a
+        d = self.d
+        pc = self.pc
+        executed = cycles
+
+        for step in range(cycles):
+            op = ops[pc]
+
+            if op < 0:
+                if op == A_INSTRUCTION:
+                    a = values[pc]
+                    pc += 1
+                    continue
+
+                # Ran off the end of the ROM
+                pc = 0
+                op = ops[0]
+                if op == A_INSTRUCTION:
+                    a = values[0]
+                    pc = 1
+                    continue
+
+            # The most frequent computations come first
+            if op == 0b1110000:
+                out = ram[a]
+            elif op == 0b0001100:
+                out = d
+            elif op == 0b1110010:
+                out = (ram[a] - 1) & 0xffff
+            elif op == 0b1110111:
+                out = (ram[a] + 1) & 0xffff
+            elif op == 0b0110000:
+                out = a
+            elif op == 0b0101010:
+                out = 0
+            elif op == 0b1000010:
+                out = (d + ram[a]) & 0xffff
+            elif op == 0b1000111:
+                out = (ram[a] - d) & 0xffff
+            elif op == 0b0110010:
+                out = (a - 1) & 0xffff
+            elif op == 0b0110111:
+                out = (a + 1) & 0xffff
+            elif op == 0b0111111:
+                out = 1
+            elif op == 0b0111010:
+                out = 0xffff
+            elif op == 0b1010011:
+                out = (d - ram[a]) & 0xffff
+            elif op == 0b0000010:
+                out = (d + a) & 0xffff
+            elif op == 0b0010011:
+                out = (d - a) & 0xffff
+            elif op == 0b0000111:
+                out = (a - d) & 0xffff
+            elif op == 0b0011111:
+                out = (d + 1) & 0xffff
+            elif op == 0b0001110:
+                out = (d - 1) & 0xffff
+            elif op == 0b1000000:
+                out = d & ram[a]
+            elif op == 0b1010101:
+                out = d | ram[a]
+            elif op == 0b0000000:
+                out = d & a
+            elif op == 0b0010101:
+                out = d | a
+            elif op == 0b1110011:
+                out = -ram[a] & 0xffff
+            elif op == 0b1110001:
+                out = ~ram[a] & 0xffff
+            elif op == 0b0001111:
+                out = -d & 0xffff
+            elif op == 0b0001101:
+                out = ~d & 0xffff
+            elif op == 0b0110011:
+                out = -a & 0xffff
+            elif op == 0b0110001:
+                out = ~a & 0xffff
+            else:
+                out = alu(op, a, d, ram[a] if op & 0b1000000 else 0)
+
+            dest = dests[pc]
+            jump = jumps[pc]
+            target = a
+
+            if dest:
+                if dest & DEST_M:
+                    ram[a] = out
+                if dest & DEST_A:
+                    a = out
+                if dest & DEST_D:
+                    d = out
+
+            if jump and (jump == 0b111 or
+                         (jump & JUMP_LT and out & 0x8000) or
+                         (jump & JUMP_EQ and not out) or
+                         (jump & JUMP_GT and out and not out & 0x8000)):
+                if target in halts and target == pc - 1:
+                    executed = step + 1
+                    pc = target
+                    break
+                pc = target
+            else:
+                pc += 1
+
+        self.a = a
+        self.d = d
+        self.pc = pc & 0x7fff
+        self.cycles += executed
+
+        return executed
+
+    def run_jit(self, cycles, halt=False):
+        """
+        Same as `run`, but executes whole basic blocks at a time. Each block
+        starting address is compiled once into a Python function and cached;
+        blocks hand over to each other through the address they return.
+        A block that doesn't fit in the remaining cycles is finished by the
+        interpreter so the cycle count stays exact.
+        """
+        blocks = self._blocks
+        lengths = self._block_lengths
+        halts = self._halts if halt else ()
+        ram = self.ram
+        a = self.a
+        d = self.d
+        pc = self.pc
+        remaining = cycles
+        halted = False
+
+        while True:
+            block = blocks[pc]
+            if block is None:
+                block = self._compile_block(pc)
+
+            length = lengths[pc]
+            if length > remaining:
+                break
+
+            remaining -= length
+            a, d, next_pc = block(ram, a, d)
+
+            # Same check as `run`: the block ended with the `0;JMP` right after `@END`
+            if next_pc in halts and next_pc == pc + length - 2:
+                pc = next_pc
+                halted = True
+                break
+            pc = next_pc
+
+        self.a = a
+        self.d = d
+        self.pc = pc
+        self.cycles += cycles - remaining
+
+        if remaining and not halted:
+            return cycles - remaining + self.run(remaining, halt=halt)
+
+        return cycles - remaining
+
+    def _compile_block(self, start):
+        """
+        Generate and compile the Python function running the straight-line
+        code from `start` up to and including the next jump
+        """
+        words = self.rom
+        lines = []
+        a_known = None  # value of A when the block has set it to a constant
+        pc = start
+
+        if start >= len(words):
+            # Nothing but `@0` up to the end of the ROM, then back to address 0
+            lines.append('return {0}, d, 0'.format(0 if start < ROM_SIZE else 'a'))
+            pc = ROM_SIZE
+
+        while pc < len(words) and pc - start < MAX_BLOCK_LENGTH:
+            word = words[pc]
+            pc += 1
+
+            if not word & 0x8000:
+                a_known = word
+                continue
+
+            comp = word >> 6 & 0b1111111
+            dest = word >> 3 & 0b111
+            jump = word & 0b111
+
+            a_source = 'a' if a_known is None else str(a_known)
+            m_source = 'ram[{}]'.format(a_source)
+            if comp in COMP_SOURCE:
+                expression = COMP_SOURCE[comp].format(a=a_source, m=m_source)
+            else:
+                expression = 'alu({0}, {1}, d, {2})'.format(
+                    comp, a_source, m_source if comp & 0b1000000 else 0)
+
+            # Fold computations that only depend on a constant A
+            if 'd' not in expression and 'ram' not in expression and 'a' not in expression:
+                expression = str(eval(expression))
+
+            # The jump target and RAM address are the A value before this instruction
+            target = a_source
+            if jump and dest & DEST_A and a_known is None:
+                lines.append('target = a')
+                target = 'target'
+
+            value = expression
+            if jump or bin(dest).count('1') > 1:
+                if not expression.isdigit():
+                    lines.append('t = ' + expression)
+                    value = 't'
+
+            if dest & DEST_M:
+                lines.append('{0} = {1}'.format(m_source, value))
+            if dest & DEST_A:
+                if value.isdigit():
+                    a_known = int(value)
+                else:
+                    lines.append('a = ' + value)
+                    a_known = None
+            if dest & DEST_D:
+                lines.append('d = ' + value)
+
+            if jump:
+                a_source = 'a' if a_known is None else str(a_known)
+                if jump == 0b111:
+                    lines.append('return {0}, d, {1}'.format(a_source, target))
+                    break
+
+                if value.isdigit():
+                    lines.append('t = ' + value)
+                lines.append('if {0}:'.format(JUMP_SOURCE[jump]))
+                lines.append('    return {0}, d, {1}'.format(a_source, target))
+                break
+
+        # Falls through, also when the block is only A-instructions
+        if not lines or not lines[-1].startswith('return'):
+            lines.append('return {0}, d, {1}'.format(
+                'a' if a_known is None else a_known, pc))
+
+        source = 'def block(ram, a, d):\n' + ''.join('    ' + line + '\n' for line in lines)
+        namespace = {'alu': alu}
+        exec(compile(source, '<block {}>'.format(start), 'exec'), namespace)
+
+        self._blocks[start] = namespace['block']
+        self._block_lengths[start] = pc - start if start < len(words) else ROM_SIZE - start
+
+        return namespace['block']
+
+
+if __name__ == '__main__':
+    import argparse
+
+    arg_parser = argparse.ArgumentParser(
+        description='Run a Hack program (.hack, .hackbin or .asm) headless')
+    arg_parser.add_argument('program')
+    arg_parser.add_argument('--cycles', type=int, default=1000000,
+                            help='maximum number of instructions to execute')
+    arg_parser.add_argument('--halt', action='store_true',
+                            help='stop as soon as the program reaches its final infinite loop')
+    arg_parser.add_argument('--jit', action='store_true',
+                            help='compile basic blocks into Python functions')
+    arg_parser.add_argument('--set', nargs='*', default=[], metavar='ADDRESS=VALUE',
+                            help='initial RAM contents')
+    arg_parser.add_argument('--dump', nargs='*', type=int, default=[], metavar='ADDRESS',
+                            help='RAM addresses to print after the run')
+    args = arg_parser.parse_args()
+
+    cpu = CPU(load_rom(args.program))
+    for assignment in args.set:
+        address, value = assignment.split('=')
+        cpu.ram[int(address)] = int(value) & 0xffff
+
+    start = time.perf_counter()
+    if args.jit:
+        cpu.run_jit(args.cycles, halt=args.halt)
+    else:
+        cpu.run(args.cycles, halt=args.halt)
+    elapsed = time.perf_counter() - start
+
+    for address in args.dump:
+        value = cpu.ram[address]
+        print('RAM[{0}] = {1}'.format(address, value - 0x10000 if value & 0x8000 else value))
+
+    print('{0} cycles in {1:.3f}s ({2:.2f} MIPS)'.format(
+        cpu.cycles, elapsed, cpu.cycles / elapsed / 1e6 if elapsed else 0))
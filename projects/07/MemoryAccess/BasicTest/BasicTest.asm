@@ -6,23 +6,11 @@ M=D
 @SP
 M=M+1
 @SP
-A=M-1
+AM=M-1
 D=M
-@popdata1
-M=D
-@0
-D=A
 @LCL
-D=D+M
-@popto1
-M=D
-@popdata1
-D=M
-@popto1
 A=M
 M=D
-@SP
-M=M-1
 @21
 D=A
 @SP
@@ -38,41 +26,20 @@ M=D
 @SP
 M=M+1
 @SP
-A=M-1
+AM=M-1
 D=M
-@popdata4
-M=D
-@2
-D=A
 @ARG
-D=D+M
-@popto4
-M=D
-@popdata4
-D=M
-@popto4
 A=M
+A=A+1
+A=A+1
 M=D
 @SP
-M=M-1
-@SP
-A=M-1
+AM=M-1
 D=M
-@popdata5
-M=D
-@1
-D=A
 @ARG
-D=D+M
-@popto5
-M=D
-@popdata5
-D=M
-@popto5
 A=M
+A=A+1
 M=D
-@SP
-M=M-1
 @36
 D=A
 @SP
@@ -80,24 +47,18 @@ A=M
 M=D
 @SP
 M=M+1
-@SP
-A=M-1
-D=M
-@popdata7
-M=D
 @6
 D=A
 @THIS
 D=D+M
-@popto7
+@R13
 M=D
-@popdata7
+@SP
+AM=M-1
 D=M
-@popto7
+@R13
 A=M
 M=D
-@SP
-M=M-1
 @42
 D=A
 @SP
@@ -113,41 +74,24 @@ M=D
 @SP
 M=M+1
 @SP
-A=M-1
+AM=M-1
 D=M
-@popdata10
-M=D
-@5
-D=A
 @THAT
-D=D+M
-@popto10
-M=D
-@popdata10
-D=M
-@popto10
 A=M
+A=A+1
+A=A+1
+A=A+1
+A=A+1
+A=A+1
 M=D
 @SP
-M=M-1
-@SP
-A=M-1
+AM=M-1
 D=M
-@popdata11
-M=D
-@2
-D=A
 @THAT
-D=D+M
-@popto11
-M=D
-@popdata11
-D=M
-@popto11
 A=M
+A=A+1
+A=A+1
 M=D
-@SP
-M=M-1
 @510
 D=A
 @SP
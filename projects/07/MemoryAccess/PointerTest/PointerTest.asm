@@ -34,23 +34,13 @@ M=D
 @SP
 M=M+1
 @SP
-A=M-1
+AM=M-1
 D=M
-@popdata5
-M=D
-@2
-D=A
 @THIS
-D=D+M
-@popto5
-M=D
-@popdata5
-D=M
-@popto5
 A=M
+A=A+1
+A=A+1
 M=D
-@SP
-M=M-1
 @46
 D=A
 @SP
@@ -58,24 +48,18 @@ A=M
 M=D
 @SP
 M=M+1
-@SP
-A=M-1
-D=M
-@popdata7
-M=D
 @6
 D=A
 @THAT
 D=D+M
-@popto7
+@R13
 M=D
-@popdata7
+@SP
+AM=M-1
 D=M
-@popto7
+@R13
 A=M
 M=D
-@SP
-M=M-1
 @THIS
 D=M
 @SP
@@ -8,6 +8,48 @@ C_FUNCTION = 'C_FUNCTION'
 C_RETURN = 'C_RETURN'
 C_CALL = 'C_CALL'
 
+# Pops with an index up to this one step the segment address with A=A+1,
+# which is no longer than going through the R13 scratch register
+SMALL_POP_INDEX = 5
+
+# Shared comparison routines of compact mode and the jump that tests x - y.
+# The caller passes its return address in D, the routine keeps it in R15.
+COMPARE_ROUTINES = {
+    'eq': ('$EQ', 'JEQ'),
+    'gt': ('$GT', 'JGT'),
+    'lt': ('$LT', 'JLT'),
+}
+COMPARE_ROUTINE = ('({0})\n@R15\nM=D\n@SP\nAM=M-1\nD=M\nA=A-1\nD=M-D\nM=-1\n@{0}.END\nD;{1}\n'
+                   '@SP\nA=M-1\nM=0\n({0}.END)\n@R15\nA=M\n0;JMP\n')
+
+
+ARITHMETIC_OPCODES = {'add', 'sub', 'neg', 'eq', 'gt', 'lt', 'and', 'or', 'not'}
+
+
+class Command:
+    '''A parsed VM command, `arg2` is the index of push and pop as an int'''
+    __slots__ = ('type', 'opcode', 'arg1', 'arg2')
+
+    def __init__(self, command_type, opcode, arg1=None, arg2=None):
+        self.type = command_type
+        self.opcode = opcode
+        self.arg1 = arg1
+        self.arg2 = arg2
+
+
+def parse_command(line):
+    '''Parse one line without its comment into a Command'''
+    command_split = line.split()
+
+    if len(command_split) == 1 and command_split[0] in ARITHMETIC_OPCODES:
+        return Command(C_ARITHMETIC, command_split[0])
+
+    if len(command_split) == 3 and command_split[0] in ('push', 'pop') and command_split[2].isdigit():
+        command_type = C_PUSH if command_split[0] == 'push' else C_POP
+        return Command(command_type, command_split[0], command_split[1], int(command_split[2]))
+
+    raise ValueError('"{}" is an invalid command'.format(line))
+
 
 class Parser:
     def __init__(self, filepath):
@@ -15,21 +57,24 @@ class Parser:
         # Check the extension of the input file
         self._check_file_extension(filepath)
 
-        vm_file = open(filepath, 'r')
-        # Ignore whitespaces and comments
-        self._lines = [
-            line.strip() for line in vm_file if not line.startswith('//') and line.strip() != '']
+        # Parse every command once, ignoring whitespaces and comments
+        self._commands = []
+        with open(filepath, 'r') as vm_file:
+            for line in vm_file:
+                line = line.split('//')[0].strip()
+                if line:
+                    self._commands.append(parse_command(line))
 
         self._current_command = None
         self._index = -1
 
     def has_more_commands(self):
-        return len(self._lines) != 0 and len(self._lines) - 1 > self._index
+        return len(self._commands) - 1 > self._index
 
     def advance(self):
         '''Move to the next command'''
         self._index += 1
-        self._current_command = self._lines[self._index]
+        self._current_command = self._commands[self._index]
 
     @property
     def current_command(self):
@@ -37,28 +82,19 @@ class Parser:
 
     @property
     def command_type(self):
-        # TODO: make sure the command exists in the specification
-        command_split = self._current_command.split()
-
-        if len(command_split) == 3:
-            return C_PUSH if command_split[0] == 'push' else C_POP
-        elif len(command_split) == 1:
-            return C_ARITHMETIC
+        return self._current_command.type
 
     @property
     def command_opcode(self):
-        if self.command_type == C_POP or self.command_type == C_PUSH:
-            return self._current_command.split()[0]
+        return self._current_command.opcode
 
     @property
     def arg1(self):
-        if self.command_type == C_POP or self.command_type == C_PUSH:
-            return self._current_command.split()[1]
+        return self._current_command.arg1
 
     @property
     def arg2(self):
-        if self.command_type == C_POP or self.command_type == C_PUSH:
-            return self._current_command.split()[2]
+        return self._current_command.arg2
 
     def _check_file_extension(self, filepath):
         try:
@@ -70,8 +106,12 @@ class Parser:
 
 
 class CodeWriter:
-    def __init__(self, filepath):
+    def __init__(self, filepath, compact=False):
         self.filename = filepath.split('/')[-1]
+        # With `compact`, comparisons call a shared routine instead of
+        # inlining their branches
+        self._compact = compact
+        self._compare_routines = set()
 
         self._output_file = open(filepath + '.asm', 'w')
         # Will use this for concatenation to make ids for some commands' symbols.
@@ -80,6 +120,12 @@ class CodeWriter:
         self._commands_written = 0
 
     def write_arithmetic(self, command):
+        if self._compact and command in COMPARE_ROUTINES:
+            self._compare_routines.add(command)
+            self._write('@COMPARED{0}\nD=A\n@{1}\n0;JMP\n(COMPARED{0})\n'.format(
+                self._commands_written, COMPARE_ROUTINES[command][0]))
+            return
+
         command_mapper = {
             'add': '@2\nD=A\n@SP\nA=M-D\nD=M\n@SP\nA=M-1\nD=D+M\nA=A-1\nM=D\n@SP\nM=M-1\n',
             'sub': '@2\nD=A\n@SP\nA=M-D\nD=M\n@SP\nA=M-1\nD=D-M\nA=A-1\nM=D\n@SP\nM=M-1\n',
@@ -132,9 +178,13 @@ class CodeWriter:
                     self._write('@SP\nA=M-1\nD=M\n@THIS\nM=D\n@SP\nM=M-1\n')
                 else:
                     self._write('@SP\nA=M-1\nD=M\n@THAT\nM=D\n@SP\nM=M-1\n')
+            elif index <= SMALL_POP_INDEX:
+                self._write(
+                    '@SP\nAM=M-1\nD=M\n@{0}\nA=M\n{1}M=D\n'.format(segment_pointer, 'A=A+1\n' * index))
             else:
+                # The target address waits in R13 while the value is popped
                 self._write(
-                    '@SP\nA=M-1\nD=M\n@popdata{0}\nM=D\n@{1}\nD=A\n@{2}\nD=D+M\n@popto{0}\nM=D\n@popdata{0}\nD=M\n@popto{0}\nA=M\nM=D\n@SP\nM=M-1\n'.format(self._commands_written, index, segment_pointer))
+                    '@{0}\nD=A\n@{1}\nD=D+M\n@R13\nM=D\n@SP\nAM=M-1\nD=M\n@R13\nA=M\nM=D\n'.format(index, segment_pointer))
         elif command_opcode == 'push':
             if segment == 'static':
                 self._write(
@@ -159,34 +209,45 @@ class CodeWriter:
         self._commands_written += 1
 
     def close(self):
-        '''Close the output file'''
+        '''Write the comparison routines that were used and close the output file'''
+        if self._compare_routines:
+            # Stop the program before it runs into the routines
+            self._write('($HALT)\n@$HALT\n0;JMP\n')
+            for command in sorted(self._compare_routines):
+                self._write(COMPARE_ROUTINE.format(*COMPARE_ROUTINES[command]))
+
         self._output_file.close()
 
 
-def main():
-    import sys
+def translate(filepath, code_writer):
+    '''Write the assembly of every command of the .vm file `filepath`'''
+    parser = Parser(filepath)
 
-    for filepath in sys.argv[1:]:
-        parser = Parser(filepath)
-        code_writer = CodeWriter(filepath.split('.')[0])
+    while parser.has_more_commands():
+        # Move to the next command
+        parser.advance()
 
-        while parser.has_more_commands():
-            # Move to the next command
-            parser.advance()
+        command = parser.current_command
 
-            command = parser.current_command
-            command_type = parser.command_type
+        if command.type == C_ARITHMETIC:
+            code_writer.write_arithmetic(command.opcode)
+        elif command.type == C_POP or command.type == C_PUSH:
+            code_writer.write_push_pop(command.opcode, command.arg1, command.arg2)
 
-            if command_type == C_ARITHMETIC:
-                code_writer.write_arithmetic(command)
-            elif command_type == C_POP or command_type == C_PUSH:
-                command_opcode = parser.command_opcode
-                memory_segment = parser.arg1
-                index = int(parser.arg2)
-
-                code_writer.write_push_pop(
-                    command_opcode, memory_segment, index)
 
+def main():
+    import argparse
+
+    arg_parser = argparse.ArgumentParser(
+        description='Translate VM code (.vm) into Hack assembly (.asm)')
+    arg_parser.add_argument('paths', nargs='+', metavar='file.vm')
+    arg_parser.add_argument('--compact', action='store_true',
+                            help='share one routine per comparison to save ROM')
+    args = arg_parser.parse_args()
+
+    for filepath in args.paths:
+        code_writer = CodeWriter(filepath.split('.')[0], compact=args.compact)
+        translate(filepath, code_writer)
         code_writer.close()
 
 
@@ -0,0 +1,227 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+# The assembler and the emulator live in project 06, the stack arithmetic
+# translator in project 07
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, '06'))
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, '07'))
+
+import VMTranslator  # noqa: E402
+from Assembler import assemble, strip_line  # noqa: E402
+from CPUEmulator import CPU  # noqa: E402
+from VMTranslatorPartII import INLINE_SIZE, CodeWriter, asm_path, find_vm_files, translate_directory  # noqa: E402
+
+
+PROJECTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+# VM programs shipped with the repo and the RAM they start with, None for the
+# ones that can't run on their own. A .vm file goes through the project 07
+# translator, a directory through this one as a whole.
+VM_PROGRAMS = [
+    (os.path.join('07', 'StackArithmetic', 'SimpleAdd', 'SimpleAdd.vm'), {0: 256}),
+    (os.path.join('07', 'StackArithmetic', 'StackTest', 'StackTest.vm'), {0: 256}),
+    (os.path.join('07', 'MemoryAccess', 'BasicTest', 'BasicTest.vm'),
+     {0: 256, 1: 300, 2: 400, 3: 3000, 4: 3010}),
+    (os.path.join('07', 'MemoryAccess', 'PointerTest', 'PointerTest.vm'), {0: 256}),
+    (os.path.join('08', 'ProgramFlow', 'BasicLoop'), None),
+    (os.path.join('08', 'ProgramFlow', 'FibonacciSeries'), None),
+    (os.path.join('08', 'FunctionCalls', 'SimpleFunction'), None),
+    (os.path.join('08', 'FunctionCalls', 'NestedCall'), {}),
+    (os.path.join('08', 'FunctionCalls', 'FibonacciElement'), {}),
+    (os.path.join('08', 'FunctionCalls', 'StaticsTest'), {}),
+    (os.path.join('08', 'FunctionCalls', 'InlineTemp'), {}),
+    (os.path.join(os.pardir, 'tools', 'OS'), None),
+]
+
+# Hack instruction memory size
+ROM_SIZE = 32768
+# Programs that don't halt by then are reported with this cycle count
+CYCLE_LIMIT = 10000000
+
+# Translator options compared against each other, the first one is the baseline
+VARIANTS = {
+    'default': {},
+    'compact': dict(compact=True),
+    'pruned': dict(prune=True),
+    'inlined': dict(inline=INLINE_SIZE),
+}
+
+
+def translate_program(path, compact=False, prune=False, inline=None):
+    """
+    Translate a .vm file or a directory of them in a scratch copy, so
+    nothing is written next to the sources, and return the assembly lines.
+    Pruning and inlining only apply to directories.
+    """
+    work_dir = tempfile.mkdtemp()
+    try:
+        if not os.path.isdir(path):
+            vm_file = os.path.join(work_dir, os.path.basename(path))
+            shutil.copyfile(path, vm_file)
+
+            code_writer = VMTranslator.CodeWriter(os.path.splitext(vm_file)[0], compact=compact)
+            VMTranslator.translate(vm_file, code_writer)
+            code_writer.close()
+
+            with open(os.path.splitext(vm_file)[0] + '.asm', 'r') as asm_file:
+                return asm_file.readlines()
+
+        program_dir = os.path.join(work_dir, os.path.basename(os.path.normpath(path)))
+        os.mkdir(program_dir)
+
+        for vm_file in find_vm_files(path):
+            shutil.copy(vm_file, program_dir)
+
+        code_writer = CodeWriter(program_dir, directory=True, compact=compact)
+        translate_directory(find_vm_files(program_dir), code_writer, compact=compact, prune=prune,
+                            inline=inline)
+        code_writer.close()
+
+        with open(asm_path(program_dir, directory=True), 'r') as asm_file:
+            return asm_file.readlines()
+    finally:
+        shutil.rmtree(work_dir)
+
+
+def time_translation(path, repeat=20, **options):
+    """
+    Best wall time of `repeat` translations of the program `path`, scratch
+    copies included
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        translate_program(path, **options)
+        elapsed = time.perf_counter() - start
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best
+
+
+def rom_size(lines):
+    """
+    Number of instructions of an assembly program. They are counted rather
+    than assembled since the point is to see by how much a program doesn't
+    fit in ROM.
+    """
+    count = 0
+    for line in lines:
+        line = strip_line(line)
+        if line and not line.startswith('('):
+            count += 1
+    return count
+
+
+def run_program(lines, ram, cycles=CYCLE_LIMIT):
+    """
+    Run an assembly program on the emulator until it halts. Returns the
+    number of instructions executed and the final stack: SP, LCL, ARG,
+    THIS, THAT and the working stack. Saved frames are left out since the
+    return addresses in them change with the code layout.
+    """
+    # Programs of project 07 just end, give them an end loop to halt in
+    words, _ = assemble(lines + ['($BENCHMARK.END)\n', '@$BENCHMARK.END\n', '0;JMP\n'])
+
+    cpu = CPU(words)
+    for address, value in ram.items():
+        cpu.ram[address] = value
+    cpu.run(cycles, halt=True)
+
+    stack_pointer, local = cpu.ram[0], cpu.ram[1]
+    base = local if 256 <= local <= stack_pointer else 256
+    return cpu.cycles, cpu.ram[0:5].tolist() + cpu.ram[base:stack_pointer].tolist()
+
+
+def _rom_cell(size):
+    return '{0}{1}'.format(size, '!' if size > ROM_SIZE else ' ')
+
+
+def compare(programs=VM_PROGRAMS, variants=VARIANTS):
+    """
+    Print the ROM size of every program under every variant, and the cycles
+    it runs for when it can run, with the change against the first variant.
+    Raises AssertionError if a variant ends with a different stack.
+    """
+    names = list(variants)
+    print('{0:<44}'.format('program') + ''.join(
+        '{0:>32}'.format(name + ' rom / cycles') for name in names))
+
+    results = []
+    for program, ram in programs:
+        measures = {}
+        stacks = {}
+        for name, options in variants.items():
+            lines = translate_program(os.path.join(PROJECTS, program), **options)
+            measures[name] = {'rom': rom_size(lines), 'cycles': None}
+            if ram is not None:
+                measures[name]['cycles'], stacks[name] = run_program(lines, ram)
+
+        if any(stack != stacks[names[0]] for stack in stacks.values()):
+            raise AssertionError('Variants end with different stacks for ' + program)
+        results.append({'program': program, 'measures': measures})
+
+        baseline = measures[names[0]]
+        cells = []
+        for name in names:
+            measure = measures[name]
+            cell = '{0:>7}'.format(_rom_cell(measure['rom']))
+            if name != names[0]:
+                cell += '{0:>+7.1%}'.format(measure['rom'] / baseline['rom'] - 1)
+            if measure['cycles'] is not None:
+                cell += '{0:>9}'.format(measure['cycles'])
+                if name != names[0]:
+                    cell += '{0:>+7.1%}'.format(measure['cycles'] / baseline['cycles'] - 1)
+            cells.append('{0:>32}'.format(cell))
+        print('{0:<44}'.format(program) + ''.join(cells))
+
+    print('(! does not fit in the {} instruction ROM)'.format(ROM_SIZE))
+    return results
+
+
+def compare_speed(programs=VM_PROGRAMS, variants=VARIANTS, repeat=20):
+    """
+    Print the best translation time of every program under every variant
+    """
+    names = list(variants)
+    print('{0:<44}'.format('program') + ''.join('{0:>12}'.format(name) for name in names))
+
+    for program, _ in programs:
+        print('{0:<44}'.format(program) + ''.join(
+            '{0:>11.4f}s'.format(time_translation(os.path.join(PROJECTS, program), repeat=repeat, **options))
+            for options in variants.values()))
+
+
+if __name__ == '__main__':
+    import argparse
+
+    arg_parser = argparse.ArgumentParser(
+        description='Compare the ROM size and cycle count of VM programs under the '
+                    'translator code generation modes')
+    arg_parser.add_argument('paths', nargs='*', metavar='path',
+                            help='.vm files for the project 07 translator or directories '
+                                 'for this one, only measured for ROM size (the 07 and 08 '
+                                 'programs and the OS by default)')
+    arg_parser.add_argument('--variants', nargs='+', choices=sorted(VARIANTS),
+                            help='modes to compare, the first one is the baseline')
+    arg_parser.add_argument('--speed', action='store_true',
+                            help='time the translation instead')
+    arg_parser.add_argument('--repeat', type=int, default=20,
+                            help='translations per timing, the best one is reported')
+    args = arg_parser.parse_args()
+
+    variants = VARIANTS
+    if args.variants:
+        variants = {name: VARIANTS[name] for name in args.variants}
+
+    programs = [(os.path.relpath(path, PROJECTS), None) for path in args.paths] or VM_PROGRAMS
+    if args.speed:
+        compare_speed(programs=programs, variants=variants, repeat=args.repeat)
+    else:
+        compare(programs=programs, variants=variants)
@@ -1,4 +1,7 @@
+import itertools
 import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
 
 # Command Types
 C_ARITHMETIC = 'C_ARITHMETIC'
@@ -12,6 +15,74 @@ C_RETURN = 'C_RETURN'
 C_CALL = 'C_CALL'
 
 
+COMMAND_TYPES = {
+    'add': C_ARITHMETIC,
+    'sub': C_ARITHMETIC,
+    'neg': C_ARITHMETIC,
+    'eq': C_ARITHMETIC,
+    'gt': C_ARITHMETIC,
+    'lt': C_ARITHMETIC,
+    'and': C_ARITHMETIC,
+    'or': C_ARITHMETIC,
+    'not': C_ARITHMETIC,
+    'push': C_PUSH,
+    'pop': C_POP,
+    'label': C_LABEL,
+    'goto': C_GOTO,
+    'if-goto': C_IF,
+    'function': C_FUNCTION,
+    'return': C_RETURN,
+    'call': C_CALL
+}
+
+# Number of arguments of each command type
+COMMAND_ARGUMENTS = {
+    C_ARITHMETIC: 0,
+    C_PUSH: 2,
+    C_POP: 2,
+    C_LABEL: 1,
+    C_GOTO: 1,
+    C_IF: 1,
+    C_FUNCTION: 2,
+    C_RETURN: 0,
+    C_CALL: 2
+}
+
+
+class Command:
+    """
+    A parsed VM command. `arg1` is the segment, label or function name and
+    `arg2` the index, number of locals or number of arguments as an int.
+    """
+    __slots__ = ('type', 'opcode', 'arg1', 'arg2')
+
+    def __init__(self, command_type, opcode, arg1=None, arg2=None):
+        self.type = command_type
+        self.opcode = opcode
+        self.arg1 = arg1
+        self.arg2 = arg2
+
+
+def parse_command(line):
+    """
+    Parse one line without its comment into a Command
+    """
+    tokens = line.split()
+    command_type = COMMAND_TYPES.get(tokens[0])
+
+    if command_type is None or len(tokens) != COMMAND_ARGUMENTS[command_type] + 1:
+        raise ValueError('"{}" is an invalid command.'.format(line))
+    if command_type in [C_PUSH, C_POP] and tokens[1] == INLINE_SEGMENT:
+        raise ValueError('"{}" is an invalid command.'.format(line))
+
+    if len(tokens) == 3:
+        if not tokens[2].isdigit():
+            raise ValueError('"{}" is an invalid command.'.format(line))
+        return Command(command_type, tokens[0], tokens[1], int(tokens[2]))
+
+    return Command(command_type, *tokens)
+
+
 class Parser:
     def __init__(self, vm_file):
         vm_file = open(vm_file, 'r')
@@ -19,247 +90,312 @@ class Parser:
         self.current_command = None
 
         self._command_counter = 0
-        # Put all commands in a list while in the process, exclude empty lines
-        # and comments.
-        # Note: inline comments will be taken care of later
-        self._commands = [
-            line.rstrip() for line in vm_file if not line.startswith('//') and line != '\n']
+        # Parse all commands at once, exclude empty lines and comments
+        self._commands = []
+        for line in vm_file:
+            if '//' in line:
+                line = line[:line.index('//')]
+            line = line.strip()
+
+            if line:
+                self._commands.append(parse_command(line))
+
+        vm_file.close()
 
     def has_more_commands(self):
         return self._command_counter < len(self._commands)
 
     def advance(self):
         if self.has_more_commands():
-            self._set_current_command()
+            self.current_command = self._commands[self._command_counter]
             self._command_counter += 1
 
     @property
     def command_type(self):
         if self.current_command:
-            opcode = self.current_command.split()[0]
-
-            command_types = {
-                'add': C_ARITHMETIC,
-                'sub': C_ARITHMETIC,
-                'neg': C_ARITHMETIC,
-                'eq': C_ARITHMETIC,
-                'gt': C_ARITHMETIC,
-                'lt': C_ARITHMETIC,
-                'and': C_ARITHMETIC,
-                'or': C_ARITHMETIC,
-                'not': C_ARITHMETIC,
-                'push': C_PUSH,
-                'pop': C_POP,
-                'label': C_LABEL,
-                'goto': C_GOTO,
-                'if-goto': C_IF,
-                'function': C_FUNCTION,
-                'return': C_RETURN,
-                'call': C_CALL
-            }
-
-            return command_types.get(opcode, None)
-
-    def _set_current_command(self):
-        """
-        Set the current command and remove inline comment if has
-        """
-        command = self._commands[self._command_counter]
-
-        try:
-            comment_index = command.index('//')
-        except ValueError:
-            self.current_command = command
-            return
-
-        self.current_command = command[:comment_index].rstrip()
+            return self.current_command.type
+
+
+def asm_path(path, directory=False):
+    """
+    Path of the .asm file generated for a .vm file or a directory of them
+    """
+    if directory:
+        directory_name = os.path.basename(path)
+        if not directory_name:
+            directory_name = path.split('/')[-2]
+        return os.path.join(path, directory_name + '.asm')
+
+    # Indicated as file_name here is the full path without extension
+    file_name = os.path.splitext(path)[0]
+    return file_name + '.asm'
+
+
+# Pops with an index up to this one step the segment address with A=A+1,
+# which is no longer than going through the R13 scratch register
+SMALL_POP_INDEX = 5
+
+# Labels of the shared routines of compact mode. VM labels always have a
+# function or file name before the `$`, so these can't collide with them.
+CALL_ROUTINE = '$CALL'
+RETURN_ROUTINE = '$RETURN'
+COMPARE_ROUTINES = {
+    'eq': ('$EQ', 'D;JEQ'),
+    'gt': ('$GT', 'D;JGT'),
+    'lt': ('$LT', 'D;JLT'),
+}
+
+# Generated code is kept in memory and written out every this many fragments
+FLUSH_FRAGMENTS = 4096
+
+# Leaf functions of up to this many commands are inlined by default. Their
+# arguments, locals and saved pointers go to scratch RAM variables, shared by
+# every inlined body since leaf functions never run inside one another. VM
+# code can't name their segment: a real call leaves every segment of the
+# caller, temp included, as it was.
+INLINE_SIZE = 12
+INLINE_SEGMENT = '$inline'
+INLINE_VARIABLE = '$INLINE.{0}'
+
+SEGMENT_POINTERS = {
+    'local': 'LCL',
+    'argument': 'ARG',
+    'this': 'THIS',
+    'that': 'THAT'
+}
+
+# Assembly templates. Every command is emitted as one finished fragment,
+# formatted from these where it has arguments.
+BOOTSTRAP = '@256\nD=A\n@SP\nM=D\n'
+
+PUSH_D = '@SP\nA=M\nM=D\n@SP\nM=M+1\n'
+POP_D = '@SP\nM=M-1\nA=M\nD=M\n'
+
+ARITHMETIC = {
+    'add': POP_D + '@SP\nM=M-1\nA=M\nM=D+M\n@SP\nM=M+1\n',
+    'sub': POP_D + '@SP\nM=M-1\nA=M\nM=M-D\n@SP\nM=M+1\n',
+    'neg': '@SP\nM=M-1\nA=M\nM=-M\n@SP\nM=M+1\n',
+    'and': POP_D + '@SP\nM=M-1\nA=M\nM=D&M\n@SP\nM=M+1\n',
+    'or': POP_D + '@SP\nM=M-1\nA=M\nM=D|M\n@SP\nM=M+1\n',
+    'not': '@SP\nM=M-1\nA=M\nM=!M\n@SP\nM=M+1\n',
+}
+COMPARE = (POP_D + '@SP\nM=M-1\nA=M\nD=M-D\n@{0}.TRUE.{1}\n{2}\n@SP\nA=M\nM=0\n@{0}.SKIP.{1}\n0;JMP\n'
+           '({0}.TRUE.{1})\n@SP\nA=M\nM=-1\n({0}.SKIP.{1})\n@SP\nM=M+1\n')
+COMPACT_COMPARE = '@{0}.RETURN.{1}\nD=A\n@{2}\n0;JMP\n({0}.RETURN.{1})\n'
+
+PUSH_CONSTANT = '@{0}\nD=A\n' + PUSH_D
+PUSH_ADDRESS = '@{0}\nD=M\n' + PUSH_D
+PUSH_SEGMENT = '@{0}\nD=A\n@{1}\nA=D+M\nD=M\n' + PUSH_D
+POP_ADDRESS = POP_D + '@{0}\nM=D\n'
+POP_SEGMENT = '@SP\nAM=M-1\nD=M\n@{0}\nA=M\n{1}M=D\n'
+POP_SEGMENT_R13 = '@{0}\nD=A\n@{1}\nD=D+M\n@R13\nM=D\n@SP\nAM=M-1\nD=M\n@R13\nA=M\nM=D\n'
+
+LABEL = '({0})\n'
+GOTO = '@{0}\n0;JMP\n'
+IF_GOTO = POP_D + '@{0}\nD;JNE\n'
+FUNCTION = '({0})\n@SP\nD=M\n@LCL\nM=D\n'
+PUSH_ZERO = '@SP\nA=M\nM=0\n@SP\nM=M+1\n'
+
+CALL = ('@{0}\nD=A\n' + PUSH_D +
+        ''.join('@{0}\nD=M\n'.format(pointer) + PUSH_D for pointer in ['LCL', 'ARG', 'THIS', 'THAT']) +
+        '@{1}\nD=A\n@SP\nD=M-D\n@ARG\nM=D\n@SP\nD=M\n@LCL\nM=D\n@{2}\n0;JMP\n({0})\n')
+COMPACT_CALL = '@{1}\nD=A\n@R13\nM=D\n@{2}\nD=A\n@R14\nM=D\n@{0}\nD=A\n@' + CALL_ROUTINE + '\n0;JMP\n({0})\n'
+
+RETURN = (
+    # endFrame = LCL
+    '@LCL\nD=M\n@endFrame\nM=D\n'
+    # retAddr = *(endFrame - 5)
+    '@5\nD=A\n@endFrame\nA=M-D\nD=M\n@retAddr\nM=D\n'
+    # *ARG = pop()
+    '@SP\nM=M-1\nA=M\nD=M\n@ARG\nA=M\nM=D\n'
+    # SP = ARG + 1
+    '@ARG\nD=M\n@SP\nM=D+1\n'
+    # THAT = *(endFrame - 1)
+    '@endFrame\nA=M-1\nD=M\n@THAT\nM=D\n'
+    # THIS, ARG and LCL = *(endFrame - 2) to *(endFrame - 4)
+    '@2\nD=A\n@endFrame\nA=M-D\nD=M\n@THIS\nM=D\n'
+    '@3\nD=A\n@endFrame\nA=M-D\nD=M\n@ARG\nM=D\n'
+    '@4\nD=A\n@endFrame\nA=M-D\nD=M\n@LCL\nM=D\n'
+    # goto retAddr
+    '@retAddr\nA=M\n0;JMP\n')
+COMPACT_RETURN = '@' + RETURN_ROUTINE + '\n0;JMP\n'
+
+# Shared part of every call in compact mode. The call site passes the return
+# address in D, 5 + the number of arguments in R13 and the address of the
+# called function in R14.
+CALL_ROUTINE_CODE = (
+    '(' + CALL_ROUTINE + ')\n'
+    # Push returnAddress
+    '@SP\nA=M\nM=D\n' +
+    # Save the caller's states
+    ''.join('@{0}\nD=M\n@SP\nAM=M+1\nM=D\n'.format(pointer) for pointer in ['LCL', 'ARG', 'THIS', 'THAT']) +
+    # Reposition LCL
+    '@SP\nMD=M+1\n@LCL\nM=D\n'
+    # Reposition ARG
+    '@R13\nD=D-M\n@ARG\nM=D\n'
+    # Transfer control to the called function
+    '@R14\nA=M\n0;JMP\n')
+
+# Shared part of every return in compact mode, with endFrame in R13 and
+# retAddr in R14
+RETURN_ROUTINE_CODE = (
+    '(' + RETURN_ROUTINE + ')\n'
+    # endFrame = LCL
+    '@LCL\nD=M\n@R13\nM=D\n'
+    # retAddr = *(endFrame - 5)
+    '@5\nA=D-A\nD=M\n@R14\nM=D\n'
+    # *ARG = pop()
+    '@SP\nAM=M-1\nD=M\n@ARG\nA=M\nM=D\n'
+    # SP = ARG + 1
+    'D=A+1\n@SP\nM=D\n' +
+    # THAT, THIS, ARG and LCL = *(endFrame - 1) to *(endFrame - 4)
+    ''.join('@R13\nAM=M-1\nD=M\n@{0}\nM=D\n'.format(pointer) for pointer in ['THAT', 'THIS', 'ARG', 'LCL']) +
+    # goto retAddr
+    '@R14\nA=M\n0;JMP\n')
+
+# Shared part of a comparison in compact mode. The call site passes its
+# return address in D, which waits in R15. x is set to true unless the jump
+# on x - y is not taken.
+COMPARE_ROUTINE_CODE = ('({0})\n@R15\nM=D\n@SP\nAM=M-1\nD=M\nA=A-1\nD=M-D\nM=-1\n@{0}.END\n{1}\n'
+                        '@SP\nA=M-1\nM=0\n({0}.END)\n@R15\nA=M\n0;JMP\n')
+
+# Stops a program without functions before it runs into the routines
+HALT = '($HALT)\n@$HALT\n0;JMP\n'
 
 
 class CodeWriter:
-    def __init__(self, path, directory=False):
-        if directory:
-            directory_name = os.path.basename(path)
-            if not directory_name:
-                directory_name = path.split('/')[-2]
-            self._asm_file = open(os.path.join(
-                path, directory_name + '.asm'), 'w')
-        else:
-            # Indicated as file_name here is the full path without extension
-            file_name = os.path.splitext(path)[0]
-            self._asm_file = open(file_name + '.asm', 'w')
+    def __init__(self, path=None, directory=False, compact=False):
+        """
+        With `compact`, calls, returns and each kind of comparison jump to
+        one shared routine instead of being inlined at every site.
+        Without `path`, the writer keeps the code of one .vm file in memory
+        as a fragment for `translate_directory` to link: no bootstrap, no
+        routines.
+        """
+        self._asm_file = None
+        self._compact = compact
+        self._compare_routines = set()  # Comparisons used in compact mode
+
+        # What each function, None outside functions, calls and compares
+        # with, and where its code starts in the buffer, so that
+        # unreachable functions can be left out at link time
+        self._calls = {}
+        self._compares = {}
+        self._function_starts = []
+
+        # Labels are namespaced by function, or by file outside functions,
+        # and numbered per namespace, so files translate independently
+        self._file_name = None
+        self._current_function = None  # Function that the current command resides in
+        self._symbol_counter = {}
 
-        self._outputfile_name = os.path.basename(
-            self._asm_file.name).split('.')[0]
+        # Code of the push and pop commands seen so far, it doesn't depend
+        # on where they are except for static ones
+        self._push_pop_code = {}
+        self._buffer = []
 
-        self._current_function = None  # Function that the current command resides in
-        self._symbol_counter = {
-            'eq': 0,
-            'gt': 0,
-            'lt': 0,
-            'popdata': 0,
-            'local': 0
-        }
+        if path is not None:
+            self._asm_file = open(asm_path(path, directory), 'w')
+            self._file_name = os.path.basename(self._asm_file.name).split('.')[0]
+            self._initialize()
 
-        self._initialize()
+    def set_file_name(self, vm_file):
+        """
+        Start the translation of a new .vm file
+        """
+        self._file_name = os.path.splitext(os.path.basename(vm_file))[0]
+        self._current_function = None
 
     def _initialize(self):
         """
         Initialize stack pointer and call `Sys.init`
         """
-        self._write_to_file('@256')
-        self._write_to_file('D=A')
-        self._write_to_file('@SP')
-        self._write_to_file('M=D')
+        self._write(BOOTSTRAP)
         self.write_call('Sys.init', 0)
 
-    def write_arithmetic(self, command):
-        opcode = command.split()[0]  # opcode of the command
+        # `Sys.init` never returns, so nothing falls through into them
+        if self._compact:
+            self._write(CALL_ROUTINE_CODE)
+            self._write(RETURN_ROUTINE_CODE)
+
+    def write_arithmetic(self, opcode):
+        if opcode in COMPARE_ROUTINES:
+            self._write_eq_gt_lt(opcode)
+        else:
+            self._write(ARITHMETIC[opcode])
+
+    def write_push_pop(self, opcode, segment, index, static_class=None):
+        if segment == 'static':
+            # Inlined functions keep using the static variables of their class
+            current_class = static_class or self._current_function.split('.')[0]
+            address = '{0}.{1}'.format(current_class, index)
+            self._write(PUSH_ADDRESS.format(address) if opcode == 'push' else POP_ADDRESS.format(address))
+            return
 
-        if opcode == 'add':
-            self._write_add(command)
+        key = (opcode, segment, index)
+        code = self._push_pop_code.get(key)
+        if code is None:
+            code = self._push_pop_code[key] = self._push_pop_fragment(opcode, segment, index)
+        self._write(code)
 
-        if opcode == 'sub':
-            self._write_sub(command)
+    def _push_pop_fragment(self, opcode, segment, index):
+        if segment == 'pointer':
+            if index not in [0, 1]:
+                raise ValueError(
+                    '"{0} pointer" with index {1} is invalid'.format(opcode, index))
 
-        if opcode == 'neg':
-            self._write_neg(command)
+            label = 'THIS' if index == 0 else 'THAT'
+            return PUSH_ADDRESS.format(label) if opcode == 'push' else POP_ADDRESS.format(label)
 
-        if opcode in ['eq', 'gt', 'lt']:
-            self._write_eq_gt_lt(command)
+        if segment == 'temp':
+            return PUSH_ADDRESS.format(5 + index) if opcode == 'push' else POP_ADDRESS.format(5 + index)
 
-        if opcode == 'and':
-            self._write_and(command)
+        if segment == INLINE_SEGMENT:
+            address = INLINE_VARIABLE.format(index)
+            return PUSH_ADDRESS.format(address) if opcode == 'push' else POP_ADDRESS.format(address)
 
-        if opcode == 'or':
-            self._write_or(command)
+        if segment == 'constant' and opcode == 'push':
+            return PUSH_CONSTANT.format(index)
 
-        if opcode == 'not':
-            self._write_not(command)
+        if segment not in SEGMENT_POINTERS:
+            raise ValueError('"{0} {1}" is invalid'.format(opcode, segment))
+        segment_pointer = SEGMENT_POINTERS[segment]
 
-    def write_push_pop(self, opcode, segment, index):
         if opcode == 'push':
-            self._write_push(segment, index)
-
-        if opcode == 'pop':
-            self._write_pop(segment, index)
+            return PUSH_SEGMENT.format(index, segment_pointer)
+        if index <= SMALL_POP_INDEX:
+            return POP_SEGMENT.format(segment_pointer, 'A=A+1\n' * index)
+        # The target address waits in R13 while the value is popped
+        return POP_SEGMENT_R13.format(index, segment_pointer)
 
-    def write_label(self, label_name):
+    def _scoped_label(self, label_name):
         if self._current_function is not None:
-            label_name = self._current_function + '$' + label_name
-        else:
-            label_name = self._outputfile_name + '$' + label_name
+            return self._current_function + '$' + label_name
+        return self._file_name + '$' + label_name
 
-        self._write_to_file('({})'.format(label_name))
+    def write_label(self, label_name):
+        self._write(LABEL.format(self._scoped_label(label_name)))
 
     def write_goto(self, label_name):
-        if self._current_function is not None:
-            label_name = self._current_function + '$' + label_name
-        else:
-            label_name = self._outputfile_name + '$' + label_name
-
-        self._write_to_file('@{}'.format(label_name))
-        self._write_to_file('0;JMP')
+        self._write(GOTO.format(self._scoped_label(label_name)))
 
     def write_if_goto(self, label_name):
-        if self._current_function is not None:
-            label_name = self._current_function + '$' + label_name
-        else:
-            label_name = self._outputfile_name + '$' + label_name
-
-        self._write_to_file('@SP')
-        self._write_to_file('M=M-1')
-        self._write_to_file('A=M')
-        self._write_to_file('D=M')
-        self._write_to_file('@{}'.format(label_name))
-        self._write_to_file('D;JNE')
+        self._write(IF_GOTO.format(self._scoped_label(label_name)))
 
     def write_function(self, function_name, num_of_local_var):
         # Add function to the scope
         self._current_function = function_name
+        self._function_starts.append((function_name, len(self._buffer)))
 
-        self._write_to_file('({})'.format(function_name))
-
-        # Set LCL pointer for the function
-        self._write_to_file('@SP')
-        self._write_to_file('D=M')
-        self._write_to_file('@LCL')
-        self._write_to_file('M=D')
-
-        # Push 0 to the stack `num_of_local_var` times
-        for _ in range(int(num_of_local_var)):
-            self._write_to_file('@SP')
-            self._write_to_file('A=M')
-            self._write_to_file('M=0')
-            self._write_to_file('@SP')
-            self._write_to_file('M=M+1')
+        # Set LCL pointer for the function and push 0 to the stack
+        # `num_of_local_var` times
+        self._write(FUNCTION.format(function_name) + PUSH_ZERO * num_of_local_var)
 
     def write_return(self):
-        # endFrame = LCL
-        self._write_to_file('@LCL')
-        self._write_to_file('D=M')
-        self._write_to_file('@endFrame')
-        self._write_to_file('M=D')
-        # retAddr = *(endFrame - 5)
-        self._write_to_file('@5')
-        self._write_to_file('D=A')
-        self._write_to_file('@endFrame')
-        self._write_to_file('A=M-D')
-        self._write_to_file('D=M')
-        self._write_to_file('@retAddr')
-        self._write_to_file('M=D')
-        # *ARG = pop()
-        self._write_to_file('@SP')
-        self._write_to_file('M=M-1')
-        self._write_to_file('A=M')
-        self._write_to_file('D=M')
-        self._write_to_file('@ARG')
-        self._write_to_file('A=M')
-        self._write_to_file('M=D')
-        # SP = ARG + 1
-        self._write_to_file('@ARG')
-        self._write_to_file('D=M')
-        self._write_to_file('@SP')
-        self._write_to_file('M=D+1')
-        # THAT = *(endFrame - 1)
-        self._write_to_file('@endFrame')
-        self._write_to_file('A=M-1')
-        self._write_to_file('D=M')
-        self._write_to_file('@THAT')
-        self._write_to_file('M=D')
-        # THIS = *(endFrame - 2)
-        self._write_to_file('@2')
-        self._write_to_file('D=A')
-        self._write_to_file('@endFrame')
-        self._write_to_file('A=M-D')
-        self._write_to_file('D=M')
-        self._write_to_file('@THIS')
-        self._write_to_file('M=D')
-        # ARG = *(endFrame - 3)
-        self._write_to_file('@3')
-        self._write_to_file('D=A')
-        self._write_to_file('@endFrame')
-        self._write_to_file('A=M-D')
-        self._write_to_file('D=M')
-        self._write_to_file('@ARG')
-        self._write_to_file('M=D')
-        # LCL = *(endFrame - 4)
-        self._write_to_file('@4')
-        self._write_to_file('D=A')
-        self._write_to_file('@endFrame')
-        self._write_to_file('A=M-D')
-        self._write_to_file('D=M')
-        self._write_to_file('@LCL')
-        self._write_to_file('M=D')
-        # goto retAddr
-        self._write_to_file('@retAddr')
-        self._write_to_file('A=M')
-        self._write_to_file('0;JMP')
+        self._write(COMPACT_RETURN if self._compact else RETURN)
 
     def write_call(self, function_name, num_of_arg_var):
-        if self._current_function is not None:
-            pre_label = self._current_function + '$ret.'
-        else:
-            pre_label = self._outputfile_name + '$ret.'
+        pre_label = self._scoped_label('ret.')
         counter = self._symbol_counter.setdefault(pre_label, 1)
 
         # Increment counter
@@ -268,423 +404,509 @@ class CodeWriter:
         # As return address
         label = pre_label + str(counter)
 
-        # Push returnAddress
-        self._write_to_file('@{}'.format(label))
-        self._write_to_file('D=A')
-        self._write_to_file('@SP')
-        self._write_to_file('A=M')
-        self._write_to_file('M=D')
-        self._write_to_file('@SP')
-        self._write_to_file('M=M+1')
-        # Save the caller's states
-        self._write_to_file('@LCL')
-        self._write_to_file('D=M')
-        self._write_to_file('@SP')
-        self._write_to_file('A=M')
-        self._write_to_file('M=D')
-        self._write_to_file('@SP')
-        self._write_to_file('M=M+1')
-        self._write_to_file('@ARG')
-        self._write_to_file('D=M')
-        self._write_to_file('@SP')
-        self._write_to_file('A=M')
-        self._write_to_file('M=D')
-        self._write_to_file('@SP')
-        self._write_to_file('M=M+1')
-        self._write_to_file('@THIS')
-        self._write_to_file('D=M')
-        self._write_to_file('@SP')
-        self._write_to_file('A=M')
-        self._write_to_file('M=D')
-        self._write_to_file('@SP')
-        self._write_to_file('M=M+1')
-        self._write_to_file('@THAT')
-        self._write_to_file('D=M')
-        self._write_to_file('@SP')
-        self._write_to_file('A=M')
-        self._write_to_file('M=D')
-        self._write_to_file('@SP')
-        self._write_to_file('M=M+1')
-        # Reposition ARG
-        self._write_to_file('@{}'.format(5 + int(num_of_arg_var)))
-        self._write_to_file('D=A')
-        self._write_to_file('@SP')
-        self._write_to_file('D=M-D')
-        self._write_to_file('@ARG')
-        self._write_to_file('M=D')
-        # Reposition LCL
-        self._write_to_file('@SP')
-        self._write_to_file('D=M')
-        self._write_to_file('@LCL')
-        self._write_to_file('M=D')
-        # Transfer control to the called function
-        self._write_to_file('@{}'.format(function_name))
-        self._write_to_file('0;JMP')
-        # Declare returnAddress label
-        self._write_to_file('({})'.format(label))
-
-    def _write_add(self, command):
-        self._write_to_file('@SP')
-        self._write_to_file('M=M-1')
-        self._write_to_file('A=M')
-        self._write_to_file('D=M')
-        self._write_to_file('@SP')
-        self._write_to_file('M=M-1')
-        self._write_to_file('A=M')
-        self._write_to_file('M=D+M')
-        self._write_to_file('@SP')
-        self._write_to_file('M=M+1')
-
-    def _write_sub(self, command):
-        self._write_to_file('@SP')
-        self._write_to_file('M=M-1')
-        self._write_to_file('A=M')
-        self._write_to_file('D=M')
-        self._write_to_file('@SP')
-        self._write_to_file('M=M-1')
-        self._write_to_file('A=M')
-        self._write_to_file('M=M-D')
-        self._write_to_file('@SP')
-        self._write_to_file('M=M+1')
-
-    def _write_neg(self, command):
-        self._write_to_file('@SP')
-        self._write_to_file('M=M-1')
-        self._write_to_file('A=M')
-        self._write_to_file('M=-M')
-        self._write_to_file('@SP')
-        self._write_to_file('M=M+1')
+        self._calls.setdefault(self._current_function, set()).add(function_name)
 
-    def _write_eq_gt_lt(self, command):
-        label = command.upper()
-        symbol_counter = self._symbol_counter[command]
-        self._symbol_counter[command] += 1  # Increment
-
-        if command == 'eq':
-            conditional_command = 'D;JEQ'
-
-        if command == 'gt':
-            conditional_command = 'D;JGT'
-
-        if command == 'lt':
-            conditional_command = 'D;JLT'
-
-        self._write_to_file('@SP')
-        self._write_to_file('M=M-1')
-        self._write_to_file('A=M')
-        self._write_to_file('D=M')
-        self._write_to_file('@SP')
-        self._write_to_file('M=M-1')
-        self._write_to_file('A=M')
-        self._write_to_file('D=M-D')
-        self._write_to_file('@{0}.TRUE.{1}'.format(label, symbol_counter))
-        self._write_to_file(conditional_command)
-        self._write_to_file('@SP')
-        self._write_to_file('A=M')
-        self._write_to_file('M=0')
-        self._write_to_file('@{0}.SKIP.{1}'.format(label, symbol_counter))
-        self._write_to_file('0;JMP')
-        self._write_to_file('({0}.TRUE.{1})'.format(label, symbol_counter))
-        self._write_to_file('@SP')
-        self._write_to_file('A=M')
-        self._write_to_file('M=-1')
-        self._write_to_file('({0}.SKIP.{1})'.format(label, symbol_counter))
-        self._write_to_file('@SP')
-        self._write_to_file('M=M+1')
-
-    def _write_and(self, command):
-        self._write_to_file('@SP')
-        self._write_to_file('M=M-1')
-        self._write_to_file('A=M')
-        self._write_to_file('D=M')
-        self._write_to_file('@SP')
-        self._write_to_file('M=M-1')
-        self._write_to_file('A=M')
-        self._write_to_file('M=D&M')
-        self._write_to_file('@SP')
-        self._write_to_file('M=M+1')
-
-    def _write_or(self, command):
-        self._write_to_file('@SP')
-        self._write_to_file('M=M-1')
-        self._write_to_file('A=M')
-        self._write_to_file('D=M')
-        self._write_to_file('@SP')
-        self._write_to_file('M=M-1')
-        self._write_to_file('A=M')
-        self._write_to_file('M=D|M')
-        self._write_to_file('@SP')
-        self._write_to_file('M=M+1')
-
-    def _write_not(self, command):
-        self._write_to_file('@SP')
-        self._write_to_file('M=M-1')
-        self._write_to_file('A=M')
-        self._write_to_file('M=!M')
-        self._write_to_file('@SP')
-        self._write_to_file('M=M+1')
-
-    def _write_push(self, segment, index):
-        if segment == 'constant':
-            self._write_to_file('@{}'.format(index))
-            self._write_to_file('D=A')
-            self._write_to_file('@SP')
-            self._write_to_file('A=M')
-            self._write_to_file('M=D')
-            self._write_to_file('@SP')
-            self._write_to_file('M=M+1')
+        template = COMPACT_CALL if self._compact else CALL
+        self._write(template.format(label, 5 + num_of_arg_var, function_name))
 
-        if segment == 'temp':
-            self._write_push_temp(index)
-
-        if segment == 'pointer':
-            self._write_push_pointer(index)
+    def _write_eq_gt_lt(self, command):
+        label = self._scoped_label(command.upper())
+        symbol_counter = self._symbol_counter.setdefault(label, 0)
+        self._symbol_counter[label] += 1  # Increment
 
-        if segment == 'static':
-            self._write_push_static(index)
-
-        if segment in ['local', 'argument', 'this', 'that']:
-            self._write_push_local_arg_this_that(segment, index)
-
-    def _write_push_temp(self, index):
-        self._write_to_file('@{}'.format(5 + int(index)))
-        self._write_to_file('D=M')
-        self._write_to_file('@SP')
-        self._write_to_file('A=M')
-        self._write_to_file('M=D')
-        self._write_to_file('@SP')
-        self._write_to_file('M=M+1')
-
-    def _write_push_pointer(self, index):
-        if index not in ['0', '1']:
-            raise ValueError(
-                '"push pointer" with index {} is invalid'.format(index))
+        routine, conditional_command = COMPARE_ROUTINES[command]
 
-        if index == '0':
-            label = 'THIS'
+        if self._compact:
+            self._compare_routines.add(command)
+            self._compares.setdefault(self._current_function, set()).add(command)
+            self._write(COMPACT_COMPARE.format(label, symbol_counter, routine))
         else:
-            label = 'THAT'
-
-        self._write_to_file('@{}'.format(label))
-        self._write_to_file('D=M')
-        self._write_to_file('@SP')
-        self._write_to_file('A=M')
-        self._write_to_file('M=D')
-        self._write_to_file('@SP')
-        self._write_to_file('M=M+1')
-
-    def _write_push_static(self, index):
-        current_class = self._current_function.split('.')[0]
-
-        self._write_to_file('@{0}.{1}'.format(current_class, index))
-        self._write_to_file('D=M')
-        self._write_to_file('@SP')
-        self._write_to_file('A=M')
-        self._write_to_file('M=D')
-        self._write_to_file('@SP')
-        self._write_to_file('M=M+1')
-
-    def _write_push_local_arg_this_that(self, segment, index):
-        if segment == 'local':
-            segment_pointer = 'LCL'
-
-        if segment == 'argument':
-            segment_pointer = 'ARG'
-
-        if segment == 'this':
-            segment_pointer = 'THIS'
-
-        if segment == 'that':
-            segment_pointer = 'THAT'
-
-        self._write_to_file('@{}'.format(index))
-        self._write_to_file('D=A')
-        self._write_to_file('@{}'.format(segment_pointer))
-        self._write_to_file('A=D+M')
-        self._write_to_file('D=M')
-        self._write_to_file('@SP')
-        self._write_to_file('A=M')
-        self._write_to_file('M=D')
-        self._write_to_file('@SP')
-        self._write_to_file('M=M+1')
-
-    def _write_pop(self, segment, index):
-        if segment == 'temp':
-            self._write_pop_temp(index)
-
-        if segment == 'pointer':
-            self._write_pop_pointer(index)
+            self._write(COMPARE.format(label, symbol_counter, conditional_command))
 
-        if segment == 'static':
-            self._write_pop_static(index)
+    def _write(self, fragment):
+        self._buffer.append(fragment)
+        if len(self._buffer) >= FLUSH_FRAGMENTS and self._asm_file is not None:
+            self._flush()
 
-        if segment in ['local', 'argument', 'this', 'that']:
-            self._write_pop_local_arg_this_that(segment, index)
+    def _flush(self):
+        self._asm_file.write(''.join(self._buffer))
+        self._buffer = []
 
-    def _write_pop_temp(self, index):
-        self._write_to_file('@SP')
-        self._write_to_file('M=M-1')
-        self._write_to_file('A=M')
-        self._write_to_file('D=M')
-        self._write_to_file('@{}'.format(5 + int(index)))
-        self._write_to_file('M=D')
+    def write_fragment(self, pieces):
+        """
+        Append pieces of code translated on their own (see `fragment`) and
+        the comparison routines they use
+        """
+        for _, _, compare_routines, code in pieces:
+            self._write(code)
+            self._compare_routines.update(compare_routines)
 
-    def _write_pop_pointer(self, index):
-        if index not in ['0', '1']:
-            raise ValueError(
-                '"pop pointer" with index {} is invalid'.format(index))
+    def fragment(self):
+        """
+        The code written so far, in pieces of one function each: lists of
+        the function name (None for code outside functions), the functions
+        it calls, the comparison routines it uses and its code
+        """
+        starts = [(None, 0)] + self._function_starts
+        ends = [start for _, start in self._function_starts] + [len(self._buffer)]
 
-        if index == '0':
-            label = 'THIS'
-        else:
-            label = 'THAT'
-
-        self._write_to_file('@SP')
-        self._write_to_file('M=M-1')
-        self._write_to_file('A=M')
-        self._write_to_file('D=M')
-        self._write_to_file('@{}'.format(label))
-        self._write_to_file('M=D')
-
-    def _write_pop_static(self, index):
-        current_class = self._current_function.split('.')[0]
-
-        self._write_to_file('@SP')
-        self._write_to_file('M=M-1')
-        self._write_to_file('A=M')
-        self._write_to_file('D=M')
-        self._write_to_file('@{0}.{1}'.format(current_class, index))
-        self._write_to_file('M=D')
-
-    def _write_pop_local_arg_this_that(self, segment, index):
-        # Use symbol counter as id for assembly symbols
-        popdata_symbol_counter = self._symbol_counter['popdata']
-        local_symbol_counter = self._symbol_counter['local']
-        self._symbol_counter['popdata'] += 1
-        self._symbol_counter['local'] += 1
-
-        if segment == 'local':
-            segment_pointer = 'LCL'
-
-        if segment == 'argument':
-            segment_pointer = 'ARG'
-
-        if segment == 'this':
-            segment_pointer = 'THIS'
-
-        if segment == 'that':
-            segment_pointer = 'THAT'
-
-        self._write_to_file('@SP')
-        self._write_to_file('M=M-1')
-        self._write_to_file('A=M')
-        self._write_to_file('D=M')
-        self._write_to_file('@popdata{}'.format(popdata_symbol_counter))
-        self._write_to_file('M=D')
-        self._write_to_file('@{}'.format(index))
-        self._write_to_file('D=A')
-        self._write_to_file('@{}'.format(segment_pointer))
-        self._write_to_file('D=D+M')
-        self._write_to_file('@{0}.{1}'.format(segment, local_symbol_counter))
-        self._write_to_file('M=D')
-        self._write_to_file('@popdata{}'.format(popdata_symbol_counter))
-        self._write_to_file('D=M')
-        self._write_to_file('@{0}.{1}'.format(segment, local_symbol_counter))
-        self._write_to_file('A=M')
-        self._write_to_file('M=D')
-
-    def _write_to_file(self, asm_command):
-        self._asm_file.write(asm_command + '\n')
+        pieces = []
+        for (function, start), end in zip(starts, ends):
+            if start < end:
+                pieces.append([function, sorted(self._calls.get(function, ())),
+                               sorted(self._compares.get(function, ())),
+                               ''.join(self._buffer[start:end])])
+        return pieces
 
     def close(self):
         """
-        Close the asm file for completion
+        Write the comparison routines that were used and close the asm file
+        for completion
         """
+        if self._compare_routines:
+            self._write(HALT)
+            for command in sorted(self._compare_routines):
+                self._write(COMPARE_ROUTINE_CODE.format(*COMPARE_ROUTINES[command]))
+
+        self._flush()
         self._asm_file.close()
 
 
-def main():
-    import sys
+def _write_command(writer, command, static_class=None):
+    command_type = command.type
 
-    def translate(vm_file, writer):
-        # Extension check
-        assert vm_file.endswith('.vm')
+    if command_type == C_ARITHMETIC:
+        writer.write_arithmetic(command.opcode)
 
-        parser = Parser(vm_file)
-        while parser.has_more_commands():
-            parser.advance()
+    elif command_type in [C_PUSH, C_POP]:
+        writer.write_push_pop(command.opcode, command.arg1, command.arg2, static_class)
 
-            command = parser.current_command
-            command_type = parser.command_type
+    elif command_type == C_LABEL:
+        writer.write_label(command.arg1)
 
-            if command_type is None:
-                raise ValueError('"{}" is an invalid command.'.format(command))
+    elif command_type == C_GOTO:
+        writer.write_goto(command.arg1)
 
-            if command_type == C_ARITHMETIC:
-                writer.write_arithmetic(command)
+    elif command_type == C_IF:
+        writer.write_if_goto(command.arg1)
 
-            if command_type in [C_PUSH, C_POP]:
-                opcode, segment, index = command.split()
+    elif command_type == C_FUNCTION:
+        writer.write_function(command.arg1, command.arg2)
 
-                writer.write_push_pop(opcode, segment, index)
+    elif command_type == C_RETURN:
+        writer.write_return()
 
-            if command_type == C_LABEL:
-                label_name = command.split()[1]
+    elif command_type == C_CALL:
+        writer.write_call(command.arg1, command.arg2)
 
-                writer.write_label(label_name)
 
-            if command_type == C_GOTO:
-                label_name = command.split()[1]
+def translate(vm_file, writer, inline=None):
+    """
+    Write the assembly of every command of `vm_file` with `writer`. Calls
+    to the functions of `inline` (see `inlinable_functions`) are replaced
+    with their body where it fits.
+    """
+    # Extension check
+    assert vm_file.endswith('.vm')
 
-                writer.write_goto(label_name)
+    writer.set_file_name(vm_file)
+    parser = Parser(vm_file)
+    inlined = 0
+    while parser.has_more_commands():
+        parser.advance()
 
-            if command_type == C_IF:
-                label_name = command.split()[1]
+        command = parser.current_command
 
-                writer.write_if_goto(label_name)
+        if command.type == C_CALL and inline and command.arg1 in inline:
+            # Numbered per file, so the labels of the body are unique in
+            # the calling function
+            commands = inline[command.arg1].expand(command.arg2, '{0}.{1}'.format(command.arg1, inlined))
+            if commands is not None:
+                inlined += 1
+                for inlined_command in commands:
+                    _write_command(writer, inlined_command, command.arg1.split('.')[0])
+                continue
 
-            if command_type == C_FUNCTION:
-                function_name, num_of_local_var = command.split()[1:]
+        _write_command(writer, command)
 
-                writer.write_function(function_name, num_of_local_var)
 
-            if command_type == C_RETURN:
-                writer.write_return()
+def translate_fragment(vm_file, compact=False, inline=None):
+    """
+    Directory worker: translate one .vm file on its own and return its code
+    in pieces of one function each (see `CodeWriter.fragment`)
+    """
+    writer = CodeWriter(compact=compact)
+    translate(vm_file, writer, inline)
+    return writer.fragment()
 
-            if command_type == C_CALL:
-                function_name, num_of_arg_var = command.split()[1:]
 
-                writer.write_call(function_name, num_of_arg_var)
+def find_vm_files(directory):
+    """
+    The .vm files of a directory, in sorted order so the output is the same
+    whatever order the file system lists them in
+    """
+    return sorted(os.path.join(directory, filename)
+                  for filename in os.listdir(directory) if filename.endswith('.vm'))
 
-    for path in sys.argv[1:]:
-        if not os.path.exists(path):
-            raise ValueError(
-                '"{}" file or directory doesn\'t exit.'.format(path))
 
-        if os.path.isdir(path):
-            # initialize an .asm output file
-            code_writer = CodeWriter(path, directory=True)
+class InlineFunction:
+    """
+    A function whose body replaces the calls to it. Its arguments and
+    locals are renamed to slots of the scratch segment, and the pointers it
+    sets are saved there and restored after it, as a return would.
+    """
+    __slots__ = ('name', 'num_of_local_var', 'commands', 'arguments', 'pointers')
 
-            # go into the directory, iterate over each `.vm` file
-            vm_files = [filename for filename in os.listdir(
-                path) if filename.endswith('.vm')]
+    def __init__(self, name, num_of_local_var, commands):
+        self.name = name
+        self.num_of_local_var = num_of_local_var
+        self.commands = commands
 
-            # join the directory path with filename
-            # for example, 'foo' turns to '/bar/foo' when 'bar' is the directory
-            for vm_file in [os.path.join(path, filename) for filename in vm_files]:
-                translate(vm_file, code_writer)
+        # Number of arguments the body accesses
+        self.arguments = 1 + max([command.arg2 for command in commands
+                                  if command.type in [C_PUSH, C_POP] and command.arg1 == 'argument'],
+                                 default=-1)
+        self.pointers = sorted(set(command.arg2 for command in commands
+                                   if command.type == C_POP and command.arg1 == 'pointer'))
 
-            # Finish by properly closing the output file
-            code_writer.close()
+    def expand(self, num_of_arg_var, prefix):
+        """
+        Commands replacing a call with `num_of_arg_var` arguments, with the
+        labels of the body prefixed by `prefix`. None if the call passes too
+        few arguments.
+        """
+        local_base = num_of_arg_var
+        pointer_base = local_base + self.num_of_local_var
+        if self.arguments > num_of_arg_var:
+            return None
+
+        # The last argument is on top of the stack
+        commands = [Command(C_POP, 'pop', INLINE_SEGMENT, index)
+                    for index in reversed(range(num_of_arg_var))]
+        for index in range(self.num_of_local_var):
+            commands.append(Command(C_PUSH, 'push', 'constant', 0))
+            commands.append(Command(C_POP, 'pop', INLINE_SEGMENT, local_base + index))
+        for slot, pointer in enumerate(self.pointers, pointer_base):
+            commands.append(Command(C_PUSH, 'push', 'pointer', pointer))
+            commands.append(Command(C_POP, 'pop', INLINE_SEGMENT, slot))
+
+        end_label = prefix + '.RETURN'
+        returns_early = False
+
+        for index, command in enumerate(self.commands):
+            if command.type in [C_PUSH, C_POP] and command.arg1 in ['argument', 'local']:
+                base = 0 if command.arg1 == 'argument' else local_base
+                command = Command(command.type, command.opcode, INLINE_SEGMENT, base + command.arg2)
+
+            elif command.type in [C_LABEL, C_GOTO, C_IF]:
+                command = Command(command.type, command.opcode, prefix + '$' + command.arg1)
+
+            elif command.type == C_RETURN:
+                # The return value is already where the call leaves it
+                if index == len(self.commands) - 1:
+                    continue
+                command = Command(C_GOTO, 'goto', end_label)
+                returns_early = True
+
+            commands.append(command)
+
+        if returns_early:
+            commands.append(Command(C_LABEL, 'label', end_label))
+        for slot, pointer in enumerate(self.pointers, pointer_base):
+            commands.append(Command(C_PUSH, 'push', INLINE_SEGMENT, slot))
+            commands.append(Command(C_POP, 'pop', 'pointer', pointer))
+
+        return commands
+
+
+# Change in stack size of each command, arithmetic ones apart
+STACK_EFFECTS = {
+    C_PUSH: 1,
+    C_POP: -1,
+    C_LABEL: 0,
+    C_GOTO: 0,
+    C_IF: -1,
+}
+
+
+def _returns_one_value(commands):
+    """
+    Whether every path through the body `commands` keeps to its own part of
+    the stack and reaches a return with nothing but the return value on it
+    """
+    labels = {command.arg1: index for index, command in enumerate(commands) if command.type == C_LABEL}
+    depths = {0: 0}
+    pending = [0]
+
+    while pending:
+        index = pending.pop()
+        if index == len(commands):
+            # Falls through into the next function
+            return False
+
+        command = commands[index]
+        depth = depths[index]
+        if command.type == C_RETURN:
+            if depth != 1:
+                return False
+            continue
+
+        if command.type == C_ARITHMETIC:
+            depth += 0 if command.opcode in ['neg', 'not'] else -1
+        else:
+            depth += STACK_EFFECTS[command.type]
+        if depth < 0:
+            return False
+
+        successors = [index + 1]
+        if command.type == C_GOTO:
+            successors = [labels.get(command.arg1)]
+        elif command.type == C_IF:
+            successors.append(labels.get(command.arg1))
+
+        for successor in successors:
+            if successor is None:
+                return False
+            if successor not in depths:
+                depths[successor] = depth
+                pending.append(successor)
+            elif depths[successor] != depth:
+                return False
+
+    return True
+
+
+def inlinable_functions(vm_files, max_size=INLINE_SIZE):
+    """
+    The functions of `vm_files` worth inlining, by name: the ones that call
+    no other function, hence aren't recursive, and have up to `max_size`
+    commands
+    """
+    bodies = {}
+    for vm_file in vm_files:
+        parser = Parser(vm_file)
+        body = None
+        while parser.has_more_commands():
+            parser.advance()
 
-        elif os.path.isfile(path):
-            code_writer = CodeWriter(path, directory=False)
+            command = parser.current_command
+            if command.type == C_FUNCTION:
+                body = bodies[command.arg1] = (command.arg2, [])
+            elif body is not None:
+                body[1].append(command)
+
+    functions = {}
+    for name, (num_of_local_var, commands) in bodies.items():
+        if len(commands) > max_size or any(command.type == C_CALL for command in commands):
+            continue
+        if _returns_one_value(commands):
+            functions[name] = InlineFunction(name, num_of_local_var, commands)
+
+    return functions
+
+
+def reachable_functions(pieces, entry='Sys.init'):
+    """
+    Names of the functions of `pieces` that `entry` calls, directly or not,
+    `entry` included
+    """
+    calls = {function: called for function, called, _, _ in pieces}
+
+    reachable = set()
+    pending = [entry]
+    while pending:
+        function = pending.pop()
+        if function in reachable or function not in calls:
+            continue
+
+        reachable.add(function)
+        pending.extend(calls[function])
+
+    return reachable
+
+
+def instruction_count(code):
+    return sum(1 for line in code.splitlines() if not line.startswith('('))
+
+
+def translate_directory(vm_files, writer, compact=False, workers=1, cache=None, prune=False, inline=None):
+    """
+    Translate `vm_files` with a pool of `workers` processes (one per CPU
+    with None) and link their fragments with `writer` in the given order.
+    The result does not depend on the number of workers.
+    With a `cache`, only the files that changed since they were cached are
+    translated, the fragments of the others are reused.
+    With `prune`, the functions that `Sys.init` never calls, directly or
+    not, are left out. Returns (function, instruction count) for each of
+    them.
+    With `inline`, calls to leaf functions of up to that many commands are
+    replaced with their body (see `inlinable_functions`).
+    """
+    fragments = [None] * len(vm_files)
+    keys = []
+
+    inline_functions = None
+    inline_key = ''
+    if inline:
+        inline_functions = inlinable_functions(vm_files, inline)
+        # Any file may inline any of them
+        inline_key = repr([(name, function.num_of_local_var,
+                            [(command.opcode, command.arg1, command.arg2) for command in function.commands])
+                           for name, function in sorted(inline_functions.items())])
+
+    if cache is not None:
+        for index, vm_file in enumerate(vm_files):
+            with open(vm_file, 'r') as file:
+                # Labels outside functions are namespaced by the file name
+                keys.append(cache.key(os.path.basename(vm_file), file.read(), str(compact), inline_key))
+
+            entry = cache.get(keys[index])
+            if entry is not None:
+                fragments[index] = entry['pieces']
+
+    missing = [index for index, fragment in enumerate(fragments) if fragment is None]
+    missing_files = [vm_files[index] for index in missing]
+
+    if workers == 1 or len(missing_files) <= 1:
+        translated = [translate_fragment(vm_file, compact, inline_functions) for vm_file in missing_files]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            translated = list(executor.map(translate_fragment, missing_files, itertools.repeat(compact),
+                                           itertools.repeat(inline_functions)))
+
+    for index, pieces in zip(missing, translated):
+        fragments[index] = pieces
+        if cache is not None:
+            cache.put(keys[index], {'pieces': pieces})
+
+    pieces = [piece for fragment in fragments for piece in fragment]
+    removed = []
+
+    if prune:
+        reachable = reachable_functions(pieces)
+
+        # Programs without Sys.init are entered some other way, keep everything
+        if reachable:
+            removed = [(piece[0], instruction_count(piece[3])) for piece in pieces
+                       if piece[0] is not None and piece[0] not in reachable]
+            pieces = [piece for piece in pieces if piece[0] is None or piece[0] in reachable]
+
+    writer.write_fragment(pieces)
+    return removed
+
+
+def open_build_cache():
+    """
+    The BuildCache of the translator, or None when this file runs without
+    project 06 next to it, where the build cache lives
+    """
+    sys.path.insert(0, os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), os.pardir, '06'))
+    try:
+        from BuildCache import BuildCache, tool_version
+    except ImportError:
+        return None
+
+    return BuildCache('vmtranslator', tool_version(__file__))
 
-            translate(path, code_writer)
 
-            # Finish by properly closing the output file
+def main():
+    import argparse
+
+    def translate_cached(path, directory, vm_files, cache, compact, workers, prune, inline):
+        if directory:
+            # Cached per file, so the whole program is relinked every time
+            code_writer = CodeWriter(path, directory=True, compact=compact)
+            removed = translate_directory(vm_files, code_writer, compact=compact, workers=workers,
+                                          cache=cache, prune=prune, inline=inline)
             code_writer.close()
 
+            if removed:
+                print('{0}: removed {1} unreachable functions, {2} instructions: {3}'.format(
+                    path, len(removed), sum(count for _, count in removed),
+                    ', '.join(function for function, _ in removed)), file=sys.stderr)
+            return
+
+        output_path = asm_path(path)
+
+        if cache is not None:
+            # The output depends on the .vm contents, the names of the .vm
+            # and .asm files and the code generation mode
+            with open(path, 'r') as file:
+                key = cache.key(os.path.basename(output_path), str(compact), str(inline),
+                                os.path.basename(path), file.read())
+
+            entry = cache.get(key)
+            if entry is not None:
+                with open(output_path, 'w') as asm_file:
+                    asm_file.write(entry['asm'])
+                return
+
+        code_writer = CodeWriter(path, compact=compact)
+        translate(path, code_writer, inlinable_functions([path], inline) if inline else None)
+
+        # Finish by properly closing the output file
+        code_writer.close()
+
+        if cache is not None:
+            with open(output_path, 'r') as asm_file:
+                cache.put(key, {'asm': asm_file.read()})
+
+    arg_parser = argparse.ArgumentParser(
+        description='Translate VM code (.vm) into Hack assembly (.asm)')
+    arg_parser.add_argument('paths', nargs='+', metavar='path',
+                            help='a .vm file or a directory of .vm files')
+    arg_parser.add_argument('--cache', action='store_true',
+                            help='reuse results cached in ~/.cache/nand2tetris, also on when '
+                                 'NAND2TETRIS_CACHE_DIR names another directory')
+    arg_parser.add_argument('--no-cache', action='store_true',
+                            help='always retranslate, even with NAND2TETRIS_CACHE_DIR set')
+    arg_parser.add_argument('--compact', action='store_true',
+                            help='share one routine for calls, returns and each comparison to save ROM')
+    arg_parser.add_argument('-j', '--jobs', type=int, default=1,
+                            help='worker processes translating the files of a directory '
+                                 '(default: 1, 0 for one per CPU)')
+    arg_parser.add_argument('--prune', action='store_true',
+                            help='leave out the functions of a directory that Sys.init never calls')
+    arg_parser.add_argument('--inline', action='store_true',
+                            help='replace calls to small functions that call no other function '
+                                 'with their body')
+    arg_parser.add_argument('--inline-size', type=int, default=INLINE_SIZE, metavar='SIZE',
+                            help='most commands of an inlined function (default: {})'.format(INLINE_SIZE))
+    arg_parser.add_argument('--stats', action='store_true',
+                            help='print how many files were reused from the cache and how many '
+                                 'were translated')
+    args = arg_parser.parse_args()
+
+    # The cache is opt-in, it writes outside the project
+    use_cache = (args.cache or os.environ.get('NAND2TETRIS_CACHE_DIR')) and not args.no_cache
+    if args.stats and not use_cache:
+        arg_parser.error('--stats reports cache use and needs the cache turned on with --cache')
+
+    workers = args.jobs or None
+    inline = args.inline_size if args.inline else None
+
+    cache = None
+    if use_cache:
+        cache = open_build_cache()
+        if cache is None and args.stats:
+            print('No build cache next to the translator, translating everything', file=sys.stderr)
+
+    for path in args.paths:
+        if not os.path.exists(path):
+            raise ValueError(
+                '"{}" file or directory doesn\'t exit.'.format(path))
+
+        if os.path.isdir(path):
+            translate_cached(path, True, find_vm_files(path), cache, args.compact, workers, args.prune,
+                             inline)
+
+        elif os.path.isfile(path):
+            translate_cached(path, False, [path], cache, args.compact, workers, args.prune, inline)
+
+    if args.stats and cache is not None:
+        print('{0} cache hits, {1} misses'.format(cache.hits, cache.misses), file=sys.stderr)
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,331 @@
+import json
+import os
+import sys
+import time
+
+# The benchmark helpers live next to the assembler in project 06
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, 'projects', '06'))
+
+from HardwareSimulator import ChipLibrary  # noqa: E402
+
+
+# Built-in chips without an .hdl implementation that are costed as another chip
+COST_ALIASES = {
+    'ARegister': 'Register',
+    'DRegister': 'Register',
+}
+
+
+class ChipCost:
+    """
+    Cost summary of one chip type: its Nand and DFF counts and enough timing
+    information to compose it into bigger chips without expanding it again.
+
+    Timing is in Nand gate delays, per pin bit. `delays[o]` maps each input
+    bit to the longest path from it to output bit `o`; `from_state[o]` is the
+    longest path from a DFF to output bit `o`; `to_state` maps each input bit
+    to the longest path from it into a DFF; `state_depth` is the longest path
+    between two DFFs inside the chip. Missing entries and None mean no path.
+    """
+
+    def __init__(self, chip):
+        self.name = chip.name
+        self.nand = 0
+        self.dff = 0
+        self.builtin = set()  # Parts without an HDL implementation, costed as 0
+
+        self.input_bits = [(pin.name, bit) for pin in chip.inputs for bit in range(pin.width)]
+        self.output_bits = [(pin.name, bit) for pin in chip.outputs for bit in range(pin.width)]
+
+        self.delays = [{} for _ in self.output_bits]
+        self.from_state = [None] * len(self.output_bits)
+        self.to_state = {}
+        self.state_depth = None
+
+    @property
+    def depth(self):
+        """
+        Longest combinational path anywhere in the chip
+        """
+        paths = [depth for delays in self.delays for depth in delays.values()]
+        paths.extend(depth for depth in self.from_state if depth is not None)
+        paths.extend(self.to_state.values())
+        if self.state_depth is not None:
+            paths.append(self.state_depth)
+        return max(paths, default=0)
+
+    def output_depths(self):
+        """
+        Longest path ending at each output pin, from an input or a DFF
+        """
+        depths = {}
+        for (pin, _), delays, state in zip(self.output_bits, self.delays, self.from_state):
+            paths = list(delays.values()) + ([state] if state is not None else [])
+            depths[pin] = max([depths.get(pin, 0)] + paths)
+        return depths
+
+    def report(self):
+        return {
+            'nand': self.nand,
+            'dff': self.dff,
+            'depth': self.depth,
+            'outputs': self.output_depths(),
+            'builtin': sorted(self.builtin),
+        }
+
+
+def _longest(current, candidate):
+    return candidate if current is None or candidate > current else current
+
+
+class CostAnalyzer:
+    """
+    Compute ChipCosts, each chip type once: Computer.hdl costs every ALU,
+    Add16 or RAM4K in it from a single analysis of that chip
+    """
+
+    def __init__(self, library):
+        self.library = library
+        self.costs = {}
+
+    def cost(self, name):
+        if name not in self.costs:
+            self.costs[name] = self._analyze(name)
+        return self.costs[name]
+
+    def _load(self, name):
+        try:
+            return self.library.load(COST_ALIASES.get(name, name))
+        except ValueError:
+            return None
+
+    def _analyze(self, name):
+        chip = self._load(name)
+        if chip is None:
+            raise ValueError('No HDL implementation of chip ' + name)
+
+        cost = ChipCost(chip)
+        cost.name = name
+
+        if chip.name == 'Nand':
+            cost.nand = 1
+            cost.delays = [{0: 1, 1: 1}]
+            return cost
+        if chip.name == 'DFF':
+            cost.dff = 1
+            cost.from_state = [0]
+            cost.to_state = {0: 0}
+            return cost
+
+        # Every signal bit is a source: ('in', input bit), ('part', part
+        # index, part output bit) or None for the constants
+        input_index = {bit: index for index, bit in enumerate(cost.input_bits)}
+        signals = {pin.name: [('in', input_index[pin.name, bit]) for bit in range(pin.width)]
+                   for pin in chip.inputs}
+        signals.update((pin.name, [None] * pin.width) for pin in chip.outputs)
+        output_names = set(pin.name for pin in chip.outputs)
+
+        parts = []
+        part_chips = []
+        for index, part in enumerate(chip.parts):
+            part_chip = self._load(part.name)
+            if part_chip is None:
+                # Only the pins of the built-in stub are known
+                part_chip = self.library.part(part.name)
+                cost.builtin.add(part.name)
+                part_cost = None
+            else:
+                part_cost = self.cost(part.name)
+                cost.nand += part_cost.nand
+                cost.dff += part_cost.dff
+                cost.builtin |= part_cost.builtin
+            parts.append(part_cost)
+            part_chips.append(part_chip)
+
+            for connection in part.connections:
+                pin = part_chip.pins[connection.pin]
+                if pin not in part_chip.outputs:
+                    continue
+
+                low, high = connection.pin_bits or (0, pin.width - 1)
+                if part_cost is None:
+                    sources = [None] * (high - low + 1)
+                else:
+                    sources = [('part', index, part_cost.output_bits.index((pin.name, bit)))
+                               for bit in range(low, high + 1)]
+                if connection.signal in output_names:
+                    # A sub bus of a chip output pin
+                    targets = signals[connection.signal]
+                    signal_low = connection.signal_bits[0] if connection.signal_bits else 0
+                    targets[signal_low:signal_low + len(sources)] = sources
+                else:
+                    signals[connection.signal] = sources
+
+        # Sources of every part input bit
+        part_inputs = []
+        for part, part_chip, part_chip_cost in zip(chip.parts, part_chips, parts):
+            if part_chip_cost is None:
+                part_inputs.append(None)
+                continue
+
+            feeds = {bit: None for bit in part_chip_cost.input_bits}
+            for connection in part.connections:
+                pin = part_chip.pins[connection.pin]
+                if pin not in part_chip.inputs or connection.signal in ('true', 'false'):
+                    continue
+                if connection.signal not in signals:
+                    raise ValueError('{0}: {1} is not connected to any part output'.format(
+                        name, connection.signal))
+
+                low, high = connection.pin_bits or (0, pin.width - 1)
+                wires = signals[connection.signal]
+                if connection.signal_bits:
+                    wires = wires[connection.signal_bits[0]:connection.signal_bits[1] + 1]
+                for bit, wire in zip(range(low, high + 1), wires):
+                    feeds[pin.name, bit] = wire
+
+            part_inputs.append([feeds[bit] for bit in part_chip_cost.input_bits])
+
+        arrivals = {}
+
+        def arrival(source):
+            """
+            ({input bit: longest path}, longest path from a DFF) at a source
+            """
+            if source is None:
+                return {}, None
+            if source[0] == 'in':
+                return {source[1]: 0}, None
+            if source in arrivals:
+                return arrivals[source]
+
+            _, index, bit = source
+            part_cost = parts[index]
+            paths = {}
+            state = part_cost.from_state[bit]
+
+            for input_bit, delay in part_cost.delays[bit].items():
+                input_paths, input_state = arrival(part_inputs[index][input_bit])
+                for chip_bit, depth in input_paths.items():
+                    paths[chip_bit] = max(paths.get(chip_bit, 0), depth + delay)
+                if input_state is not None:
+                    state = _longest(state, input_state + delay)
+
+            arrivals[source] = paths, state
+            return arrivals[source]
+
+        for pin in chip.outputs:
+            for bit, source in enumerate(signals[pin.name]):
+                position = cost.output_bits.index((pin.name, bit))
+                cost.delays[position], cost.from_state[position] = arrival(source)
+
+        for index, part_cost in enumerate(parts):
+            if part_cost is None:
+                continue
+            if part_cost.state_depth is not None:
+                cost.state_depth = _longest(cost.state_depth, part_cost.state_depth)
+
+            for input_bit, delay in part_cost.to_state.items():
+                input_paths, input_state = arrival(part_inputs[index][input_bit])
+                for chip_bit, depth in input_paths.items():
+                    cost.to_state[chip_bit] = max(cost.to_state.get(chip_bit, 0), depth + delay)
+                if input_state is not None:
+                    cost.state_depth = _longest(cost.state_depth, input_state + delay)
+
+        return cost
+
+
+def find_hdl_files(paths):
+    """
+    Expand files and directory trees into a sorted list of .hdl files
+    """
+    hdl_files = []
+
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, _, filenames in os.walk(path):
+                hdl_files.extend(os.path.join(directory, filename)
+                                 for filename in filenames if filename.endswith('.hdl'))
+        else:
+            hdl_files.append(path)
+
+    return sorted(hdl_files)
+
+
+def analyze(paths):
+    """
+    Cost report of every chip in `paths`, keyed by chip name. Chips are
+    analyzed with the parts found next to them, like the simulator does.
+    """
+    analyzers = {}
+    chips = {}
+
+    for path in find_hdl_files(paths):
+        directory = os.path.dirname(os.path.abspath(path))
+        if directory not in analyzers:
+            analyzers[directory] = CostAnalyzer(ChipLibrary(directory))
+
+        name = os.path.splitext(os.path.basename(path))[0]
+        chips[name] = analyzers[directory].cost(name).report()
+
+    return chips
+
+
+def compare_reports(baseline, report):
+    """
+    Print the chips whose cost changed since `baseline`
+    """
+    print('\nCompared to {}:'.format(baseline.get('commit')))
+    for name, chip in sorted(report['chips'].items()):
+        before = baseline['chips'].get(name)
+        if before is None or (before['nand'], before['depth']) == (chip['nand'], chip['depth']):
+            continue
+
+        print('{0:<12} nand {1:>7} -> {2:<7} depth {3:>4} -> {4}'.format(
+            name, before['nand'], chip['nand'], before['depth'], chip['depth']))
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from Benchmark import current_commit
+
+    projects = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'projects')
+
+    arg_parser = argparse.ArgumentParser(
+        description='Report the Nand gate count and critical path depth of HDL chips')
+    arg_parser.add_argument('paths', nargs='*', metavar='path',
+                            help='.hdl files or directories (projects 01 to 05 by default)')
+    arg_parser.add_argument('--output', metavar='cost.json',
+                            help='write the report as JSON')
+    arg_parser.add_argument('--compare', metavar='baseline.json',
+                            help='print the chips whose cost changed since an earlier report')
+    args = arg_parser.parse_args()
+
+    paths = args.paths or [os.path.join(projects, project)
+                           for project in ('01', '02', '03', '05')]
+
+    start = time.perf_counter()
+    report = {
+        'commit': current_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'chips': analyze(paths),
+    }
+    elapsed = time.perf_counter() - start
+
+    print('{0:<12} {1:>8} {2:>6} {3:>6}  {4}'.format('chip', 'nand', 'dff', 'depth', 'outputs'))
+    for name, chip in sorted(report['chips'].items()):
+        print('{0:<12} {1:>8} {2:>6} {3:>6}  {4}{5}'.format(
+            name, chip['nand'], chip['dff'], chip['depth'],
+            ' '.join('{0}={1}'.format(pin, depth) for pin, depth in chip['outputs'].items()),
+            '  (without {})'.format(', '.join(chip['builtin'])) if chip['builtin'] else ''))
+    print('{0} chips in {1:.3f}s'.format(len(report['chips']), elapsed))
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+
+    if args.compare:
+        with open(args.compare, 'r') as baseline_file:
+            compare_reports(json.load(baseline_file), report)
@@ -0,0 +1,961 @@
+import os
+import random
+import re
+import sys
+import time
+
+from array import array
+
+# The CPU emulator lives next to the assembler in project 06
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, 'projects', '06'))
+
+from CPUEmulator import load_rom  # noqa: E402
+from TestRunner import TestScript, UnsupportedScript, format_value, parse_value  # noqa: E402
+
+
+PROJECTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'projects')
+
+# Where chips used as parts are looked up after the directory of the chip
+# being loaded, so a project 05 chip is built from the project 01-03 chips
+HDL_PATH = [os.path.join(PROJECTS, *project)
+            for project in (('01',), ('02',), ('03', 'a'), ('03', 'b'), ('05',))]
+
+# Pin declarations of the chips the course provides as Java classes
+BUILTIN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'builtInChips')
+
+# Wires 0 and 1 of every netlist are the constants false and true
+FALSE = 0
+TRUE = 1
+
+# Largest number of input bits enumerated for a complete truth table
+EXHAUSTIVE_LIMIT = 20
+
+# Most Nand gates and DFFs in one netlist, well above a gate-level RAM64;
+# a gate-level RAM16K needs millions and gigabytes of memory
+GATE_LIMIT = 1 << 17
+
+TOKEN_PATTERN = re.compile(r'\.\.|\w+|[{}();,=\[\]:]')
+# `RAM16K[3]` or `DRegister[]`: the state of a part with a behavioral model
+STATE_PATTERN = re.compile(r'^(\w+)\[(\d*)\]$')
+
+
+class Pin:
+    """
+    A chip input or output pin
+    """
+
+    def __init__(self, name, width):
+        self.name = name
+        self.width = width
+
+
+class Connection:
+    """
+    One `pin[range]=signal[range]` argument of a part. Ranges are
+    (low, high) bit indices or None for the whole bus.
+    """
+
+    def __init__(self, pin, pin_bits, signal, signal_bits):
+        self.pin = pin
+        self.pin_bits = pin_bits
+        self.signal = signal
+        self.signal_bits = signal_bits
+
+
+class Part:
+    def __init__(self, name, connections):
+        self.name = name
+        self.connections = connections
+
+
+class Chip:
+    """
+    A chip definition parsed from an .hdl file
+    """
+
+    def __init__(self, name, inputs, outputs, parts, builtin=None, clocked=()):
+        self.name = name
+        self.inputs = inputs
+        self.outputs = outputs
+        self.parts = parts
+        self.builtin = builtin
+        self.clocked = clocked
+        self.model = None  # Behavioral model class replacing the parts
+
+        self.pins = {pin.name: pin for pin in inputs + outputs}
+
+
+def parse_hdl(text):
+    """
+    Parse the text of an .hdl file into a Chip
+    """
+    text = re.sub(r'/\*.*?\*/', ' ', text, flags=re.DOTALL)
+    text = re.sub(r'//[^\n]*', ' ', text)
+    tokens = TOKEN_PATTERN.findall(text)
+    position = [0]
+
+    def peek():
+        return tokens[position[0]] if position[0] < len(tokens) else None
+
+    def take(expected=None):
+        token = peek()
+        if token is None or (expected is not None and token != expected):
+            raise ValueError('Expected {0}, got {1}'.format(expected or 'more input', token))
+        position[0] += 1
+        return token
+
+    def bits():
+        # Optional `[i]` or `[i..j]`
+        if peek() != '[':
+            return None
+        take('[')
+        low = high = int(take())
+        if peek() == '..':
+            take('..')
+            high = int(take())
+        take(']')
+        return low, high
+
+    def pins():
+        declared = []
+        while True:
+            name = take()
+            width = 1
+            if peek() == '[':
+                take('[')
+                width = int(take())
+                take(']')
+            declared.append(Pin(name, width))
+            if take() == ';':
+                return declared
+
+    take('CHIP')
+    name = take()
+    take('{')
+
+    inputs, outputs, parts = [], [], []
+    builtin, clocked = None, ()
+
+    while peek() != '}':
+        section = take()
+
+        if section == 'IN':
+            inputs = pins()
+        elif section == 'OUT':
+            outputs = pins()
+        elif section == 'BUILTIN':
+            builtin = take()
+            take(';')
+        elif section == 'CLOCKED':
+            clocked = [pin.name for pin in pins()]
+        elif section == 'PARTS':
+            take(':')
+            while peek() not in ('}', 'BUILTIN', 'CLOCKED'):
+                part_name = take()
+                take('(')
+                connections = []
+                while True:
+                    pin = take()
+                    pin_bits = bits()
+                    take('=')
+                    signal = take()
+                    connections.append(Connection(pin, pin_bits, signal, bits()))
+                    if take() == ')':
+                        break
+                take(';')
+                parts.append(Part(part_name, connections))
+        else:
+            raise ValueError('Unexpected {0} in chip {1}'.format(section, name))
+
+    take('}')
+
+    return Chip(name, inputs, outputs, parts, builtin, clocked)
+
+
+class RegisterModel:
+    """
+    Bit, Register, ARegister and DRegister: out(t+1) = in(t) if load(t).
+    Like the built-in chips, the stored value changes on the tick and the
+    output follows on the tock.
+    """
+
+    def __init__(self, chip):
+        self.value = 0
+        self._next = 0
+
+    def evaluate(self):
+        return [self.value]
+
+    def tick(self, pins):
+        self._next = pins['in'] if pins['load'] else self.value
+
+    def tock(self):
+        self.value = self._next
+
+    def __getitem__(self, index):
+        return self._next
+
+    def __setitem__(self, index, value):
+        self.value = self._next = value
+
+
+class PCModel(RegisterModel):
+    def tick(self, pins):
+        if pins['reset']:
+            self._next = 0
+        elif pins['load']:
+            self._next = pins['in']
+        elif pins['inc']:
+            self._next = (self.value + 1) & 0xffff
+        else:
+            self._next = self.value
+
+
+class RAMModel:
+    """
+    RAM8 up to RAM16K and the screen: one word per address, written on the
+    clock and read combinationally
+    """
+
+    def __init__(self, chip):
+        self.words = array('H', [0]) * (1 << chip.pins['address'].width)
+        self._write = None
+
+    def evaluate(self, address):
+        return [self.words[address]]
+
+    def tick(self, pins):
+        self._write = (pins['address'], pins['in']) if pins['load'] else None
+
+    def tock(self):
+        if self._write is not None:
+            address, value = self._write
+            self.words[address] = value
+            self._write = None
+
+    def __getitem__(self, index):
+        if self._write is not None and self._write[0] == index:
+            return self._write[1]
+        return self.words[index]
+
+    def __setitem__(self, index, value):
+        self.words[index] = value
+
+
+class ROMModel(RAMModel):
+    """
+    ROM32K, loaded by the `ROM32K load Program.hack` script command
+    """
+
+    def load(self, path):
+        words = load_rom(path)
+        self.words = array('H', words) + array('H', [0]) * (len(self.words) - len(words))
+
+    def tick(self, pins):
+        pass
+
+    def tock(self):
+        pass
+
+
+class KeyboardModel(RegisterModel):
+    """
+    The key currently pressed, set by the test script (nothing is pressed in
+    headless runs)
+    """
+
+    def tick(self, pins):
+        pass
+
+    def tock(self):
+        pass
+
+
+# Behavioral models of the built-in chips, used instead of their parts
+MODELS = {
+    'Bit': RegisterModel,
+    'Register': RegisterModel,
+    'ARegister': RegisterModel,
+    'DRegister': RegisterModel,
+    'PC': PCModel,
+    'RAM8': RAMModel,
+    'RAM64': RAMModel,
+    'RAM512': RAMModel,
+    'RAM4K': RAMModel,
+    'RAM16K': RAMModel,
+    'Screen': RAMModel,
+    'ROM32K': ROMModel,
+    'Keyboard': KeyboardModel,
+}
+
+
+class ChipLibrary:
+    """
+    Find and parse chip definitions, each one once.
+
+    Like the official simulator, a part is implemented by its behavioral
+    model when its .hdl file isn't next to the chip being loaded. With
+    `builtin`, every part that has a model uses it, so a RAM16K is tested
+    on top of fast RAM4K models instead of millions of gates.
+    """
+
+    def __init__(self, directory=None, path=HDL_PATH, builtin=False):
+        self.directory = directory
+        self.path = ([directory] if directory else []) + list(path)
+        self.builtin = builtin
+        self._models = {}
+        self._chips = {
+            'Nand': Chip('Nand', [Pin('a', 1), Pin('b', 1)], [Pin('out', 1)], [], 'Nand'),
+            'DFF': Chip('DFF', [Pin('in', 1)], [Pin('out', 1)], [], 'DFF', ['in']),
+        }
+
+    def load(self, name):
+        """
+        Definition of a chip from its .hdl file
+        """
+        if name not in self._chips:
+            self._chips[name] = self._parse(name)
+
+        return self._chips[name]
+
+    def part(self, name):
+        """
+        Definition of a chip used as a part, which may be a behavioral model
+        """
+        if name in MODELS and (self.builtin or not self._local(name)):
+            if name not in self._models:
+                with open(os.path.join(BUILTIN_PATH, name + '.hdl'), 'r') as hdl_file:
+                    chip = parse_hdl(hdl_file.read())
+                chip.model = MODELS[name]
+                self._models[name] = chip
+            return self._models[name]
+
+        return self.load(name)
+
+    def _local(self, name):
+        return self.directory is not None and \
+            os.path.exists(os.path.join(self.directory, name + '.hdl'))
+
+    def _parse(self, name):
+        for directory in self.path:
+            path = os.path.join(directory, name + '.hdl')
+            if os.path.exists(path):
+                with open(path, 'r') as hdl_file:
+                    chip = parse_hdl(hdl_file.read())
+                if chip.builtin and not chip.parts:
+                    continue  # A stub pointing at a Java class, keep looking
+                return chip
+
+        raise ValueError('No HDL implementation of chip ' + name)
+
+
+class Netlist:
+    """
+    A chip flattened down to Nand gates, DFFs and behavioral models over
+    numbered wires, sorted so every gate comes after the gates driving its
+    inputs, and compiled into one Python function.
+
+    Every wire value is an int whose bits are independent simulation lanes,
+    so a single call evaluates as many input vectors as there are lanes.
+    Behavioral models work on plain values and limit the netlist to one lane.
+    """
+
+    def __init__(self, chip, library):
+        self.chip = chip
+        self.wire_count = 2
+        self.gates = []  # (out, a, b)
+        self.dffs = []  # (out, in)
+        self.models = []  # (model, chip, {pin: wires})
+        self._aliases = {}
+
+        self.inputs = {pin.name: self._wires(pin.width) for pin in chip.inputs}
+        self.outputs = {pin.name: self._wires(pin.width) for pin in chip.outputs}
+
+        pins = dict(self.inputs)
+        pins.update(self.outputs)
+        self._expand(chip, pins, library)
+
+        # Pin wires driven by a part output are aliases of that output
+        self.outputs = {name: [self._resolve(wire) for wire in wires]
+                        for name, wires in self.outputs.items()}
+        self.gates = [(self._resolve(out), self._resolve(a), self._resolve(b))
+                      for out, a, b in self.gates]
+        self.dffs = [(self._resolve(out), self._resolve(wire)) for out, wire in self.dffs]
+        self.models = [(model, model_chip, {name: [self._resolve(wire) for wire in wires]
+                                            for name, wires in pins.items()})
+                       for model, model_chip, pins in self.models]
+
+        self.nodes = self._levelize()
+        self.gates = [node for node in self.nodes if isinstance(node, tuple)]
+        self.depth = self._depth()
+        self.evaluate = self._compile()
+
+    def _wires(self, width):
+        first = self.wire_count
+        self.wire_count += width
+        return list(range(first, first + width))
+
+    def _resolve(self, wire):
+        while wire in self._aliases:
+            wire = self._aliases[wire]
+        return wire
+
+    def _expand(self, chip, pins, library):
+        """
+        Add the gates of one chip instance whose pins are connected to the
+        given wires. Output pin wires are driven by the parts' outputs.
+        """
+        if chip.name in ('Nand', 'DFF') and len(self.gates) + len(self.dffs) >= GATE_LIMIT:
+            raise ValueError('{0} has more than {1} gates, simulate its memory parts '
+                             'with behavioral models instead'.format(self.chip.name, GATE_LIMIT))
+        if chip.name == 'Nand':
+            self.gates.append((pins['out'][0], pins['a'][0], pins['b'][0]))
+            return
+        if chip.name == 'DFF':
+            self.dffs.append((pins['out'][0], pins['in'][0]))
+            return
+        if chip.model is not None:
+            self.models.append((chip.model(chip), chip, pins))
+            return
+
+        signals = dict(pins)
+        part_chips = [library.part(part.name) for part in chip.parts]
+
+        # Internal signals are all created first since parts can use
+        # signals produced by parts listed after them
+        for part, part_chip in zip(chip.parts, part_chips):
+            for connection in part.connections:
+                pin = part_chip.pins.get(connection.pin)
+                if pin is None:
+                    raise ValueError('{0} has no pin {1}'.format(part.name, connection.pin))
+
+                if pin in part_chip.outputs and connection.signal not in signals:
+                    signals[connection.signal] = self._wires(
+                        _width(connection.pin_bits, pin.width))
+
+        for part, part_chip in zip(chip.parts, part_chips):
+            # Unconnected inputs are false
+            part_pins = {pin.name: [FALSE] * pin.width for pin in part_chip.inputs}
+            part_pins.update((pin.name, self._wires(pin.width)) for pin in part_chip.outputs)
+
+            for connection in part.connections:
+                pin = part_chip.pins[connection.pin]
+                low, high = connection.pin_bits or (0, pin.width - 1)
+                pin_wires = part_pins[pin.name]
+
+                if pin in part_chip.inputs:
+                    pin_wires[low:high + 1] = _source(
+                        signals, connection, high - low + 1, chip.name)
+                else:
+                    if connection.signal in ('true', 'false'):
+                        raise ValueError('{0}: cannot drive {1}'.format(chip.name, connection.signal))
+                    targets = _select(signals[connection.signal], connection.signal_bits)
+                    if len(targets) != high - low + 1:
+                        raise ValueError('{0}: width mismatch on {1}'.format(
+                            chip.name, connection.signal))
+
+                    for target, wire in zip(targets, pin_wires[low:high + 1]):
+                        if target in self._aliases:
+                            raise ValueError('{0}: {1} has more than one source'.format(
+                                chip.name, connection.signal))
+                        self._aliases[target] = wire
+
+            self._expand(part_chip, part_pins, library)
+
+    def _levelize(self):
+        """
+        Order the gates and models that the outputs and clocked inputs depend
+        on so each one comes after its inputs' gates. Unused gates are
+        dropped. Gates are listed as (out, a, b) and models by index.
+        """
+        driver = {gate[0]: gate for gate in self.gates}
+        for index, (_, chip, pins) in enumerate(self.models):
+            driver.update((wire, index) for pin in chip.outputs for wire in pins[pin.name])
+
+        roots = [wire for wires in self.outputs.values() for wire in wires]
+        roots.extend(wire for _, wire in self.dffs)
+        roots.extend(wire for _, _, pins in self.models
+                     for wires in pins.values() for wire in wires)
+
+        ordered = []
+        done = set()
+        visiting = set()
+
+        for root in roots:
+            stack = [(root, False)]
+            while stack:
+                wire, expanded = stack.pop()
+                if wire not in driver:
+                    continue
+
+                node = driver[wire]
+                if node in done:
+                    continue
+                if expanded:
+                    visiting.discard(node)
+                    done.add(node)
+                    ordered.append(node)
+                    continue
+
+                if node in visiting:
+                    raise ValueError('Combinational loop in chip ' + self.chip.name)
+                visiting.add(node)
+                stack.append((wire, True))
+                stack.extend((source, False) for source in self._sources(node))
+
+        return ordered
+
+    def _sources(self, node):
+        if isinstance(node, tuple):
+            return node[1:]
+
+        # Clocked inputs of a model only matter on the next clock edge
+        _, chip, pins = self.models[node]
+        return [wire for pin in chip.inputs if pin.name not in chip.clocked
+                for wire in pins[pin.name]]
+
+    def _depth(self):
+        """
+        Longest chain of Nand gates between any two clocked, model or pin
+        boundaries
+        """
+        levels = {}
+        for out, a, b in self.gates:
+            levels[out] = max(levels.get(a, 0), levels.get(b, 0)) + 1
+        return max(levels.values(), default=0)
+
+    def _compile(self):
+        """
+        Generate `evaluate(inputs, state, mask)`: `inputs` holds the value of
+        every input pin wire and `state` of every DFF, in order. It returns
+        the values of the output pin wires, of the DFF inputs and the input
+        pins of every model, to be clocked in on the next tick.
+        """
+        names = {FALSE: '0', TRUE: 'm'}
+        lines = []
+
+        input_wires = [wire for wires in self.inputs.values() for wire in wires]
+        for index, wire in enumerate(input_wires):
+            names[wire] = 'w{}'.format(wire)
+            lines.append('w{0} = inputs[{1}]'.format(wire, index))
+        for index, (wire, _) in enumerate(self.dffs):
+            names[wire] = 'w{}'.format(wire)
+            lines.append('w{0} = state[{1}]'.format(wire, index))
+
+        for node in self.nodes:
+            if not isinstance(node, tuple):
+                _, chip, pins = self.models[node]
+                arguments = [_packed(names, pins[pin.name])
+                             for pin in chip.inputs if pin.name not in chip.clocked]
+                lines.append('o = models[{0}].evaluate({1})'.format(node, ', '.join(arguments)))
+
+                for index, pin in enumerate(chip.outputs):
+                    for bit, wire in enumerate(pins[pin.name]):
+                        names[wire] = 'w{}'.format(wire)
+                        lines.append('w{0} = o[{1}] >> {2} & 1'.format(wire, index, bit))
+                continue
+
+            out, a, b = node
+            # Undriven wires are false
+            a_name = names.get(a, '0')
+            b_name = names.get(b, '0')
+
+            # Fold the constants, Nand(x, true) and Nand(x, x) are Not(x)
+            if a_name == '0' or b_name == '0':
+                names[out] = 'm'
+                continue
+            if a_name == 'm' and b_name == 'm':
+                names[out] = '0'
+                continue
+
+            names[out] = 'w{}'.format(out)
+            if b_name == 'm' or a_name == b_name:
+                lines.append('w{0} = m ^ {1}'.format(out, a_name))
+            elif a_name == 'm':
+                lines.append('w{0} = m ^ {1}'.format(out, b_name))
+            else:
+                lines.append('w{0} = m ^ ({1} & {2})'.format(out, a_name, b_name))
+
+        outputs = [names.get(wire, '0') for wires in self.outputs.values() for wire in wires]
+        state = [names.get(wire, '0') for _, wire in self.dffs]
+        clocked = ['{' + ', '.join("'{0}': {1}".format(pin.name, _packed(names, pins[pin.name]))
+                                   for pin in chip.inputs) + '}'
+                   for _, chip, pins in self.models]
+        lines.append('return [{0}], [{1}], [{2}]'.format(
+            ', '.join(outputs), ', '.join(state), ', '.join(clocked)))
+
+        source = 'def evaluate(inputs, state, m):\n' + ''.join(
+            '    ' + line + '\n' for line in lines)
+        namespace = {'models': [model for model, _, _ in self.models]}
+        exec(compile(source, '<chip {}>'.format(self.chip.name), 'exec'), namespace)
+
+        return namespace['evaluate']
+
+    def evaluate_vectors(self, vectors, state=None):
+        """
+        Evaluate a list of {input pin: value} vectors in one pass and return
+        the list of {output pin: value} results. Missing inputs are 0.
+        """
+        if self.models:
+            raise ValueError('Chips with behavioral models run one vector at a time')
+
+        count = len(vectors)
+        mask = (1 << count) - 1
+
+        inputs = []
+        for name, wires in self.inputs.items():
+            values = [vector.get(name, 0) for vector in vectors]
+            inputs.extend(pack(values, bit, count) for bit in range(len(wires)))
+
+        outputs, _, _ = self.evaluate(inputs, state or [0] * len(self.dffs), mask)
+
+        results = [{} for _ in vectors]
+        index = 0
+        for name, wires in self.outputs.items():
+            columns = unpack(outputs[index:index + len(wires)], count)
+            index += len(wires)
+            for result, value in zip(results, columns):
+                result[name] = value
+
+        return results
+
+    def model(self, name):
+        """
+        The first instance of the behavioral model of chip `name`
+        """
+        for model, chip, _ in self.models:
+            if chip.name == name:
+                return model
+
+        raise ValueError('No {} part with a behavioral model'.format(name))
+
+
+def _width(bits, default):
+    return default if bits is None else bits[1] - bits[0] + 1
+
+
+def _select(wires, bits):
+    if bits is None:
+        return wires
+    if bits[1] >= len(wires):
+        raise ValueError('Sub bus {0}..{1} out of range'.format(*bits))
+    return wires[bits[0]:bits[1] + 1]
+
+
+def _source(signals, connection, width, chip_name):
+    """
+    Wires feeding a part input of the given width
+    """
+    if connection.signal in ('true', 'false'):
+        return [TRUE if connection.signal == 'true' else FALSE] * width
+
+    if connection.signal not in signals:
+        raise ValueError('{0}: {1} is not connected to any part output'.format(
+            chip_name, connection.signal))
+
+    wires = _select(signals[connection.signal], connection.signal_bits)
+    if len(wires) != width:
+        raise ValueError('{0}: width mismatch on {1}'.format(chip_name, connection.signal))
+
+    return wires
+
+
+def _packed(names, wires):
+    """
+    Source of the value of a bus, for models (single lane, so m is 1)
+    """
+    terms = [name if bit == 0 else '{0} << {1}'.format(name, bit)
+             for bit, name in enumerate(names.get(wire, '0') for wire in wires) if name != '0']
+    return ' | '.join(terms) or '0'
+
+
+def pack(values, bit, count):
+    """
+    Gather `bit` of every value into one int, value i going to bit i
+    """
+    if count == 1:
+        return values[0] >> bit & 1
+
+    return int(''.join('1' if value >> bit & 1 else '0' for value in reversed(values)), 2)
+
+
+def unpack(bit_values, count):
+    """
+    Inverse of `pack` over a bus: turn one int per bit back into `count` values
+    """
+    values = [0] * count
+
+    for bit, lanes in enumerate(bit_values):
+        if not lanes:
+            continue
+        lanes = format(lanes, '0{}b'.format(count))[::-1]
+        weight = 1 << bit
+        for index, lane in enumerate(lanes):
+            if lane == '1':
+                values[index] += weight
+
+    return values
+
+
+class ChipSimulator:
+    """
+    Clocked simulation of one chip instance, one vector at a time
+    """
+
+    def __init__(self, netlist):
+        self.netlist = netlist
+        self.pins = {name: 0 for name in list(netlist.inputs) + list(netlist.outputs)}
+        self.state = [0] * len(netlist.dffs)
+        self._next_state = list(self.state)
+        self._latched = self._next_state
+        self._model_inputs = [{} for _ in netlist.models]
+        self.clock = 0
+        self.tick_phase = False
+
+    @property
+    def time(self):
+        return '{0}{1}'.format(self.clock, '+' if self.tick_phase else '')
+
+    def set(self, name, value):
+        if name not in self.netlist.inputs:
+            raise ValueError('{} is not an input pin'.format(name))
+        self.pins[name] = value & ((1 << len(self.netlist.inputs[name])) - 1)
+
+    def eval(self):
+        netlist = self.netlist
+        inputs = [self.pins[name] >> bit & 1
+                  for name, wires in netlist.inputs.items() for bit in range(len(wires))]
+        outputs, self._next_state, self._model_inputs = netlist.evaluate(inputs, self.state, 1)
+
+        index = 0
+        for name, wires in netlist.outputs.items():
+            self.pins[name] = sum(outputs[index + bit] << bit for bit in range(len(wires)))
+            index += len(wires)
+
+    def tick(self):
+        # Clocked parts sample their inputs; outputs change on the tock
+        self.eval()
+        self._latched = self._next_state
+        for (model, _, _), pins in zip(self.netlist.models, self._model_inputs):
+            model.tick(pins)
+        self.tick_phase = True
+
+    def tock(self):
+        self.state = self._latched
+        for model, _, _ in self.netlist.models:
+            model.tock()
+        self.clock += 1
+        self.tick_phase = False
+        self.eval()
+
+
+class HardwareTestScript(TestScript):
+    """
+    Run a hardware simulator test script. Scripts for combinational chips
+    are run in one pass: every `output` row is recorded and all the rows are
+    evaluated together when the script ends. With `builtin`, parts with a
+    behavioral model use it even when their .hdl file is present.
+    """
+
+    def __init__(self, path, builtin=False):
+        TestScript.__init__(self, path)
+        self.builtin = builtin
+        self.netlist = None
+        self.simulator = None
+        self._pending = []  # (output line, columns, pins shown, pins evaluated)
+        self._evaluated = {}
+
+    def run(self):
+        TestScript.run(self)
+
+        if self._pending:
+            vectors = [evaluated for _, _, _, evaluated in self._pending]
+            results = self.netlist.evaluate_vectors(vectors)
+
+            for (line, columns, pins, _), result in zip(self._pending, results):
+                pins.update(result)
+                self.output[line] = self._format_row(columns, pins)
+            self._pending = []
+
+        return self.output
+
+    def _load(self, chip_file):
+        if chip_file is None or not chip_file.endswith('.hdl'):
+            raise UnsupportedScript('cannot load {}'.format(chip_file))
+
+        library = ChipLibrary(self.directory, builtin=self.builtin)
+        self.netlist = Netlist(library.load(chip_file[:-len('.hdl')]), library)
+        self.simulator = ChipSimulator(self.netlist)
+
+    def _chip(self):
+        if self.simulator is None:
+            raise ValueError('No chip loaded')
+        return self.simulator
+
+    def _combinational(self):
+        netlist = self._chip().netlist
+        return not netlist.dffs and not netlist.models
+
+    def _simulator_command(self, command):
+        name = command[0]
+        simulator = self._chip()
+
+        if name == 'eval':
+            if self._combinational():
+                self._evaluated = {pin: simulator.pins[pin] for pin in self.netlist.inputs}
+            else:
+                simulator.eval()
+        elif name == 'tick':
+            simulator.tick()
+        elif name == 'tock':
+            simulator.tock()
+        elif len(command) == 3 and command[1] == 'load':
+            # `ROM32K load Program.hack`
+            self.netlist.model(name).load(self._find(command[2]))
+        else:
+            raise UnsupportedScript('unsupported command ' + name)
+
+    def _set(self, variable, value):
+        match = STATE_PATTERN.match(variable)
+        if match:
+            self._state(match.group(1))[int(match.group(2) or 0)] = parse_value(value) & 0xffff
+        else:
+            self._chip().set(variable, parse_value(value))
+
+    def _variable(self, variable):
+        simulator = self._chip()
+
+        if variable == 'time':
+            return simulator.time
+
+        match = STATE_PATTERN.match(variable)
+        if match:
+            return self._state(match.group(1))[int(match.group(2) or 0)]
+        if variable not in simulator.pins:
+            raise UnsupportedScript('cannot output ' + variable)
+
+        return simulator.pins[variable]
+
+    def _state(self, name):
+        try:
+            return self._chip().netlist.model(name)
+        except ValueError:
+            raise UnsupportedScript('{} is simulated at the gate level'.format(name))
+
+    def _output(self):
+        if not self._combinational():
+            TestScript._output(self)
+            return
+
+        # Placeholder line, filled in by `run`
+        self._pending.append((len(self.output), self.columns,
+                              dict(self._chip().pins), dict(self._evaluated)))
+        self.output.append(None)
+
+    def _format_row(self, columns, pins):
+        return '|' + '|'.join(
+            format_value(pins[variable], column_format)
+            for variable, column_format in columns) + '|'
+
+
+def exhaustive_vectors(netlist):
+    """
+    Every combination of the chip inputs, packed as one int per input wire
+    """
+    widths = [(name, len(wires)) for name, wires in netlist.inputs.items()]
+    bits = sum(width for _, width in widths)
+    count = 1 << bits
+
+    # Input bit k alternates between 2**k zeros and 2**k ones
+    lanes = []
+    all_lanes = (1 << count) - 1
+    for k in range(bits):
+        run = 1 << k
+        period = ((1 << run) - 1) << run
+        lanes.append(period * (all_lanes // ((1 << (2 * run)) - 1)))
+
+    return lanes, count
+
+
+def random_vectors(netlist, count, seed=0):
+    rng = random.Random(seed)
+    wires = sum(len(wires) for wires in netlist.inputs.values())
+    return [rng.getrandbits(count) for _ in range(wires)], count
+
+
+def compare_chips(netlist, reference, vectors=None, seed=0):
+    """
+    Check that two combinational chips with the same pins agree on the
+    complete truth table, or on `vectors` random inputs when the inputs are
+    too wide to enumerate. Returns (vectors checked, first mismatching
+    vector index or None).
+    """
+    if vectors is None and sum(len(w) for w in netlist.inputs.values()) <= EXHAUSTIVE_LIMIT:
+        lanes, count = exhaustive_vectors(netlist)
+    else:
+        lanes, count = random_vectors(netlist, vectors or 1000000, seed)
+
+    mask = (1 << count) - 1
+    actual = netlist.evaluate(lanes, [0] * len(netlist.dffs), mask)[0]
+    expected = reference.evaluate(lanes, [0] * len(reference.dffs), mask)[0]
+
+    difference = 0
+    for left, right in zip(actual, expected):
+        difference |= left ^ right
+
+    if not difference:
+        return count, None
+    return count, (difference & -difference).bit_length() - 1
+
+
+if __name__ == '__main__':
+    import argparse
+
+    arg_parser = argparse.ArgumentParser(
+        description='Flatten an HDL chip to Nand gates and simulate it bit-parallel')
+    arg_parser.add_argument('chip', metavar='chip.hdl')
+    arg_parser.add_argument('--compare', metavar='reference.hdl',
+                            help='check the chip against another implementation, on its '
+                                 'complete truth table when the inputs are narrow enough')
+    arg_parser.add_argument('--vectors', type=int, default=None,
+                            help='number of random vectors for --compare and --throughput')
+    arg_parser.add_argument('--throughput', action='store_true',
+                            help='measure how many random vectors are evaluated per second')
+    arg_parser.add_argument('--builtin', action='store_true',
+                            help='use the behavioral models of RAMs, registers and I/O '
+                                 'parts even where their .hdl is present')
+    args = arg_parser.parse_args()
+
+    def load(path):
+        library = ChipLibrary(os.path.dirname(os.path.abspath(path)), builtin=args.builtin)
+        name = os.path.splitext(os.path.basename(path))[0]
+        return Netlist(library.load(name), library)
+
+    start = time.perf_counter()
+    netlist = load(args.chip)
+    print('{0}: {1} Nand gates, {2} DFFs, {3} models, depth {4} (built in {5:.3f}s)'.format(
+        netlist.chip.name, len(netlist.gates), len(netlist.dffs), len(netlist.models),
+        netlist.depth, time.perf_counter() - start))
+
+    if args.compare:
+        reference = load(args.compare)
+        if list(reference.inputs) != list(netlist.inputs) or \
+                list(reference.outputs) != list(netlist.outputs):
+            sys.exit('{0} and {1} have different pins'.format(args.chip, args.compare))
+
+        count, mismatch = compare_chips(netlist, reference, args.vectors)
+        if mismatch is None:
+            print('Equivalent on {} vectors'.format(count))
+        else:
+            sys.exit('Vector {0} of {1} differs'.format(mismatch, count))
+
+    if args.throughput:
+        if netlist.models:
+            sys.exit('--throughput needs a chip without behavioral models')
+        lanes, count = random_vectors(netlist, args.vectors or 1000000)
+        start = time.perf_counter()
+        netlist.evaluate(lanes, [0] * len(netlist.dffs), (1 << count) - 1)
+        elapsed = time.perf_counter() - start
+        print('{0} vectors in {1:.3f}s ({2:.0f} vectors/s)'.format(
+            count, elapsed, count / elapsed if elapsed else 0))
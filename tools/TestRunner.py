@@ -0,0 +1,495 @@
+import os
+import re
+import sys
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# The CPU emulator lives next to the assembler in project 06
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, 'projects', '06'))
+
+from CPUEmulator import CPU, load_rom  # noqa: E402
+
+
+# Programs the CPU emulator can load; scripts that load anything else (.hdl
+# chips, VM directories) belong to the other simulators and are skipped
+PROGRAM_EXTENSIONS = ('.hack', '.hackbin', '.asm')
+
+# Output format of a column without an explicit %F<left>.<width>.<right>
+DEFAULT_FORMAT = ('D', 1, 6, 1)
+
+TOKEN_PATTERN = re.compile(r'"[^"]*"|[,;{}]|[^\s,;{}]+')
+COLUMN_PATTERN = re.compile(r'^(.+?)(?:%([BDSX])(\d+)\.(\d+)\.(\d+))?$')
+RAM_PATTERN = re.compile(r'^RAM\[(\d+)\]$')
+
+
+class UnsupportedScript(Exception):
+    """
+    Raised for scripts meant for another simulator
+    """
+    pass
+
+
+def parse_script(text):
+    """
+    Parse a test script into a list of commands. Every command is a tuple
+    of its name and its arguments; `repeat` carries its count and the list
+    of commands in its body, `while` its condition words and its body.
+    """
+    text = re.sub(r'/\*.*?\*/', ' ', text, flags=re.DOTALL)
+    text = re.sub(r'//[^\n]*', ' ', text)
+    tokens = TOKEN_PATTERN.findall(text)
+
+    commands, position = _parse_block(tokens, 0, nested=False)
+    return commands
+
+
+def _parse_block(tokens, position, nested):
+    """
+    Parse commands from `position` up to the end of the script, or up to the
+    closing brace when `nested`. Returns the commands and the position after
+    the block.
+    """
+    commands = []
+    words = []
+
+    while position < len(tokens):
+        token = tokens[position]
+        position += 1
+
+        if token in (',', ';'):
+            if words:
+                commands.append(_parse_command(words))
+                words = []
+        elif token == '{':
+            if not words or words[0] not in ('repeat', 'while'):
+                raise ValueError('Block without repeat or while: ' + ' '.join(words))
+            body, position = _parse_block(tokens, position, nested=True)
+            if words[0] == 'while':
+                commands.append(('while', words[1:], body))
+            else:
+                count = int(words[1]) if len(words) > 1 else None
+                commands.append(('repeat', count, body))
+            words = []
+        elif token == '}':
+            if not nested:
+                raise ValueError('Unexpected }')
+            if words:
+                commands.append(_parse_command(words))
+            return commands, position
+        else:
+            words.append(token)
+
+    if nested:
+        raise ValueError('Missing }')
+    if words:
+        commands.append(_parse_command(words))
+
+    return commands, position
+
+
+def _parse_command(words):
+    name = words[0]
+
+    if name == 'output-list':
+        return (name, [_parse_column(column) for column in words[1:]])
+    if name == 'set':
+        if len(words) != 3:
+            raise ValueError('Invalid set: ' + ' '.join(words))
+        return (name, words[1], words[2])
+
+    return tuple(words)
+
+
+def _parse_column(column):
+    """
+    Split `RAM[0]%D2.6.2` into the variable and its (format, left padding,
+    width, right padding)
+    """
+    match = COLUMN_PATTERN.match(column)
+    variable, kind = match.group(1), match.group(2)
+
+    if kind is None:
+        return variable, DEFAULT_FORMAT
+    return variable, (kind, int(match.group(3)), int(match.group(4)), int(match.group(5)))
+
+
+def lines_match(actual, expected):
+    """
+    Compare an output line with a .cmp line, where a column of asterisks
+    matches any value
+    """
+    if actual == expected:
+        return True
+
+    actual_cells = actual.split('|')
+    expected_cells = expected.split('|')
+    if len(actual_cells) != len(expected_cells):
+        return False
+
+    return all(got == wanted or (wanted.strip() and not wanted.strip('* '))
+               for got, wanted in zip(actual_cells, expected_cells))
+
+
+def parse_value(text):
+    """
+    Parse a script value: decimal, or %D, %X and %B prefixed
+    """
+    bases = {'%D': 10, '%X': 16, '%B': 2}
+    base = bases.get(text[:2].upper())
+
+    if base is None:
+        return int(text)
+    return int(text[2:], base)
+
+
+def format_header(variable, column_format):
+    _, left, width, right = column_format
+    size = left + width + right
+
+    # Names that don't fit are cut, the others centered
+    name = variable[:size]
+    before = (size - len(name)) // 2
+    return ' ' * before + name + ' ' * (size - len(name) - before)
+
+
+def format_value(value, column_format):
+    kind, left, width, right = column_format
+
+    # Strings (such as the hardware simulator's clock) are left aligned
+    if isinstance(value, str):
+        return ' ' * left + value[:width].ljust(width) + ' ' * right
+    if kind == 'S':
+        text = chr(value) if 32 <= value < 127 else ''
+        return ' ' * left + text.ljust(width) + ' ' * right
+
+    if kind == 'D':
+        text = str(value - 0x10000 if value & 0x8000 else value)
+    elif kind == 'X':
+        text = '{:04X}'.format(value)[-width:]
+    else:
+        text = '{:016b}'.format(value)[-width:]
+
+    return ' ' * left + text.rjust(width) + ' ' * right
+
+
+class TestScript:
+    """
+    Run a CPU emulator test script and compare its output with the .cmp file
+    named by its `compare-to` command
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.directory = os.path.dirname(path)
+
+        with open(path, 'r') as script_file:
+            self.commands = parse_script(script_file.read())
+
+        self.cpu = None
+        self.columns = []
+        self.output = []
+        self.compare_to = None
+        self.output_file = None
+
+    def run(self):
+        """
+        Execute the script and return the output lines
+        """
+        self._execute(self.commands)
+        return self.output
+
+    def compare(self):
+        """
+        Return None if the output matches the .cmp file, or a description of
+        the first difference
+        """
+        if self.compare_to is None:
+            raise UnsupportedScript('no compare-to file')
+
+        with open(self._find(self.compare_to), 'r') as compare_file:
+            expected = [line.rstrip() for line in compare_file]
+
+        # Like the official tools, ignore blank lines at the end of the file
+        while expected and not expected[-1]:
+            expected.pop()
+
+        for number, (actual, wanted) in enumerate(zip(self.output, expected), 1):
+            if not lines_match(actual, wanted):
+                return 'Comparison failure at line {0}:\n  expected: {1}\n  actual:   {2}'.format(
+                    number, wanted, actual)
+
+        if len(self.output) != len(expected):
+            return 'Expected {0} lines of output, got {1}'.format(
+                len(expected), len(self.output))
+
+        return None
+
+    def write_output(self):
+        if self.output_file is not None:
+            with open(os.path.join(self.directory, self.output_file), 'w') as out_file:
+                out_file.writelines(line + '\n' for line in self.output)
+
+    def _execute(self, commands):
+        for command in commands:
+            name = command[0]
+
+            if name == 'repeat':
+                _, count, body = command
+                if count is None:
+                    raise UnsupportedScript('repeat without a count never ends')
+
+                self._repeat(count, body)
+            elif name == 'set':
+                self._set(command[1], command[2])
+            elif name == 'output':
+                self._output()
+            elif name == 'output-list':
+                self.columns = command[1]
+                self._output_header()
+            elif name == 'load':
+                self._load(command[1] if len(command) > 1 else None)
+            elif name == 'compare-to':
+                self.compare_to = command[1]
+            elif name == 'output-file':
+                self.output_file = command[1]
+            elif name in ('echo', 'clear-echo'):
+                pass
+            else:
+                self._simulator_command(command)
+
+    def _repeat(self, count, body):
+        if body == [('ticktock',)]:
+            self._cpu().run_jit(count)
+        else:
+            for _ in range(count):
+                self._execute(body)
+
+    def _simulator_command(self, command):
+        """
+        Commands that depend on the simulator the script is written for
+        """
+        if command[0] == 'ticktock':
+            self._cpu().run(1)
+        else:
+            raise UnsupportedScript('unsupported command ' + command[0])
+
+    def _load(self, program):
+        if program is None or os.path.splitext(program)[1] not in PROGRAM_EXTENSIONS:
+            raise UnsupportedScript('cannot load {}'.format(program))
+
+        self.cpu = CPU(load_rom(self._find(program)))
+
+    def _find(self, filename):
+        """
+        Path of a file next to the script. Scripts written on case-insensitive
+        systems don't always match the case of the file name.
+        """
+        path = os.path.join(self.directory, filename)
+        if os.path.exists(path):
+            return path
+
+        for candidate in os.listdir(self.directory or os.curdir):
+            if candidate.lower() == filename.lower():
+                return os.path.join(self.directory, candidate)
+
+        return path
+
+    def _cpu(self):
+        if self.cpu is None:
+            raise ValueError('No program loaded')
+        return self.cpu
+
+    def _variable(self, variable):
+        cpu = self._cpu()
+
+        match = RAM_PATTERN.match(variable)
+        if match:
+            return cpu.ram[int(match.group(1))]
+        if variable == 'PC':
+            return cpu.pc
+        if variable == 'A':
+            return cpu.a
+        if variable == 'D':
+            return cpu.d
+        if variable == 'time':
+            return cpu.cycles
+
+        raise ValueError('Unknown variable ' + variable)
+
+    def _set(self, variable, value):
+        cpu = self._cpu()
+        value = parse_value(value) & 0xffff
+
+        match = RAM_PATTERN.match(variable)
+        if match:
+            cpu.ram[int(match.group(1))] = value
+        elif variable == 'PC':
+            cpu.pc = value & 0x7fff
+        elif variable == 'A':
+            cpu.a = value
+        elif variable == 'D':
+            cpu.d = value
+        else:
+            raise ValueError('Cannot set ' + variable)
+
+    def _output_header(self):
+        self.output.append('|' + '|'.join(
+            format_header(variable, column_format)
+            for variable, column_format in self.columns) + '|')
+
+    def _output(self):
+        self.output.append('|' + '|'.join(
+            format_value(self._variable(variable), column_format)
+            for variable, column_format in self.columns) + '|')
+
+
+def find_test_scripts(paths):
+    """
+    Expand files and directory trees into a sorted list of .tst files
+    """
+    scripts = []
+
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, _, filenames in os.walk(path):
+                scripts.extend(os.path.join(directory, filename)
+                               for filename in filenames if filename.endswith('.tst'))
+        else:
+            scripts.append(path)
+
+    return sorted(scripts)
+
+
+def open_script(path, gate_level=False):
+    """
+    Open a script with the simulator matching the file it loads: chips go to
+    the hardware simulator, programs to the CPU emulator. Chips are built on
+    the behavioral models of their memory parts unless `gate_level`.
+    """
+    script = TestScript(path)
+
+    loads = [command for command in script.commands if command[0] == 'load']
+    if loads and len(loads[0]) > 1 and loads[0][1].endswith('.hdl'):
+        # Imported here since the hardware simulator builds on this module
+        from HardwareSimulator import HardwareTestScript
+        return HardwareTestScript(path, builtin=not gate_level)
+
+    return script
+
+
+def run_test(path, write_output=False, gate_level=False):
+    """
+    Pool worker: run one script and return (path, status, seconds, message)
+    where status is 'passed', 'failed', 'skipped' or 'error'
+    """
+    start = time.perf_counter()
+
+    try:
+        script = open_script(path, gate_level)
+        script.run()
+        if write_output:
+            script.write_output()
+        difference = script.compare()
+    except UnsupportedScript as reason:
+        return path, 'skipped', time.perf_counter() - start, str(reason)
+    except Exception as error:
+        return path, 'error', time.perf_counter() - start, '{0}: {1}'.format(
+            type(error).__name__, error)
+
+    status = 'failed' if difference else 'passed'
+    return path, status, time.perf_counter() - start, difference
+
+
+def run_tests(paths, workers=None, write_output=False, gate_level=False):
+    """
+    Run every test script found in `paths` with a pool of `workers` processes
+    (one per CPU by default). Returns one result per script, in sorted order.
+    A script whose worker dies, e.g. killed for running out of memory on a
+    big chip at gate level, gets an error result instead of stopping the run.
+    """
+    scripts = find_test_scripts(paths)
+
+    if workers == 1 or len(scripts) <= 1:
+        return [run_test(path, write_output, gate_level) for path in scripts]
+
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_test, path, write_output, gate_level) for path in scripts]
+        for future in futures:
+            try:
+                results.append(future.result())
+            except BrokenProcessPool:
+                results.append(None)
+
+    # A dead worker breaks the whole pool, so the scripts that didn't finish
+    # are run again one by one to find out which one it was
+    return [result or _run_isolated(path, write_output, gate_level)
+            for path, result in zip(scripts, results)]
+
+
+def _run_isolated(path, write_output, gate_level):
+    """
+    Run one script in a process of its own, so that only this script fails
+    if the process dies
+    """
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        try:
+            return executor.submit(run_test, path, write_output, gate_level).result()
+        except BrokenProcessPool:
+            return (path, 'error', time.perf_counter() - start,
+                    'The worker process died, possibly killed for running out of memory')
+
+
+if __name__ == '__main__':
+    import argparse
+
+    projects = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'projects')
+
+    arg_parser = argparse.ArgumentParser(
+        description='Run test scripts (.tst) and compare them with their .cmp files')
+    arg_parser.add_argument('paths', nargs='*', metavar='path',
+                            help='.tst files or directories (projects 01 to 08 by default)')
+    arg_parser.add_argument('-j', '--jobs', type=int, default=None,
+                            help='number of worker processes (default and 0: one per CPU)')
+    arg_parser.add_argument('--write-output', action='store_true',
+                            help="write each script's output-file next to it")
+    arg_parser.add_argument('--gate-level', action='store_true',
+                            help='simulate every chip with an .hdl file down to Nand gates '
+                                 'instead of using the RAM, register and I/O models; '
+                                 'chips over the gate limit are reported as errors')
+    arg_parser.add_argument('-v', '--verbose', action='store_true',
+                            help='also list skipped scripts')
+    args = arg_parser.parse_args()
+
+    paths = args.paths or [os.path.join(projects, project)
+                           for project in ('01', '02', '03', '04', '05', '06', '07', '08')]
+
+    # Go through the imported module rather than __main__ so the hardware
+    # simulator and the workers share its exception classes
+    import TestRunner
+
+    start = time.perf_counter()
+    results = TestRunner.run_tests(paths, workers=args.jobs or None, write_output=args.write_output,
+                                   gate_level=args.gate_level)
+    elapsed = time.perf_counter() - start
+
+    counts = {'passed': 0, 'failed': 0, 'skipped': 0, 'error': 0}
+    for path, status, seconds, message in results:
+        counts[status] += 1
+
+        if status == 'skipped' and not args.verbose:
+            continue
+
+        print('{0:<7} {1} ({2:.2f}s)'.format(status.upper(), os.path.relpath(path), seconds))
+        if message and status != 'passed':
+            print('        ' + message.replace('\n', '\n        '))
+
+    print('{0} passed, {1} failed, {2} errors, {3} skipped in {4:.2f}s'.format(
+        counts['passed'], counts['failed'], counts['error'], counts['skipped'], elapsed))
+
+    if counts['failed'] or counts['error']:
+        sys.exit(1)